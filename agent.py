@@ -0,0 +1,127 @@
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+from local_state import get_state_dir, load_state, save_state
+
+# Port and token of the running agent, in the per-user state directory so
+# only this user's clients can reach it
+AGENT_STATE_FILE = 'agent.json'
+
+
+class _AgentRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        import hmac
+
+        try:
+            request = json.loads(self.rfile.readline())
+            if not hmac.compare_digest(str(request.get('token')), self.server.token):
+                return
+            reply = self.server.handler(request)
+        except Exception as e:
+            reply = {'ok': False, 'error': str(e)}
+        self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+class AgentServer:
+    """Answer requests from agent clients on a localhost socket
+
+    Runs inside a long-lived process (the tray) whose lock state is already
+    warm, so opening a file doesn't pay for a new interpreter, imports and a
+    cold lock read. Each request is one JSON line carrying the token from the
+    state file, and handler(request) returns the JSON reply.
+    """
+
+    def __init__(self, handler, log=print):
+        self.handler = handler
+        self.log = log
+        self.server = None
+
+    def start(self):
+        """Start listening on a free localhost port, returns True on success"""
+        import secrets
+
+        try:
+            self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _AgentRequestHandler)
+        except OSError as e:
+            self.log(f"Agent unavailable: {e}")
+            return False
+        self.server.daemon_threads = True
+        self.server.handler = self.handler
+        self.server.token = secrets.token_hex(16)
+
+        port = self.server.server_address[1]
+        save_state(AGENT_STATE_FILE, {'port': port, 'token': self.server.token, 'pid': os.getpid()})
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.log(f"Agent listening on 127.0.0.1:{port}")
+        return True
+
+    def stop(self):
+        """Stop listening and remove the state file if it is still ours"""
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        state = load_state(AGENT_STATE_FILE)
+        if isinstance(state, dict) and state.get('token') == self.server.token:
+            try:
+                os.remove(os.path.join(get_state_dir(), AGENT_STATE_FILE))
+            except OSError:
+                pass
+        self.server = None
+
+
+def send_request(request, timeout=10):
+    """Send a request to the running agent, returns its reply or None if no agent answers"""
+    state = load_state(AGENT_STATE_FILE)
+    if not isinstance(state, dict):
+        return None
+    try:
+        with socket.create_connection(('127.0.0.1', state['port']), timeout=timeout) as sock:
+            sock.sendall(json.dumps(dict(request, token=state['token'])).encode('utf-8') + b'\n')
+            reply = sock.makefile('rb').readline()
+        return json.loads(reply)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def run_main(args):
+    """Run a main.py command in this process"""
+    import main
+
+    sys.argv = [main.__file__] + args
+    main.main()
+
+
+def open_file(file_path):
+    """Lock a file through the agent and open it in SolidWorks
+
+    Falls back to 'main.py open' when no agent is running or the file can't
+    be locked, so locked files still get the warning and a read-only copy.
+    """
+    file_path = os.path.abspath(file_path)
+    reply = send_request({'action': 'open', 'path': file_path})
+    if not reply or not reply.get('ok'):
+        run_main(['open', file_path])
+        return
+
+    import subprocess
+
+    solidworks_path = os.getenv('SOLIDWORKS_PATH', r"C:\Program Files\SOLIDWORKS Corp\SOLIDWORKS\SLDWORKS.exe")
+    try:
+        subprocess.Popen([solidworks_path, file_path])
+        print(f"Opening normally: {os.path.basename(file_path)}")
+    except OSError as e:
+        print(f"Error opening SolidWorks: {e}")
+        print(f"Verify SolidWorks path: {solidworks_path}")
+
+
+# Thin client: 'open' goes through the agent, anything else to main.py
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1].lower() == 'open':
+        open_file(sys.argv[2])
+    else:
+        run_main(sys.argv[1:])
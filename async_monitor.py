@@ -0,0 +1,137 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncMonitor:
+    """Run the auto-monitor loop as coroutines on an asyncio event loop
+
+    Each cycle overlaps independent round trips instead of making them one
+    after another: the process check runs alongside the heartbeat, the scan
+    alongside handling watcher events, and each opened or closed file's lock
+    is acquired or released concurrently. Blocking calls run on a bounded
+    thread pool of max_workers. stop() cancels the loop from any thread;
+    the cycle in progress is abandoned and the pool is drained before run()
+    returns.
+    """
+
+    def __init__(self, manager, max_workers=8):
+        self.manager = manager
+        self.max_workers = max_workers
+        self.loop = None
+        self.main_task = None
+
+    def run(self):
+        """Run the monitor until stop() is called (blocks the calling thread)"""
+        asyncio.run(self._main())
+
+    def stop(self):
+        """Cancel the monitor from another thread"""
+        loop, task = self.loop, self.main_task
+        if loop and task:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # Loop already closed
+        # Unblock a pool thread waiting for watcher events
+        self.manager.watcher.wake()
+
+    async def _call(self, func, *args, **kwargs):
+        """Run a blocking call on the thread pool"""
+        return await self.loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(self.max_workers, thread_name_prefix='cadlock-io'))
+        self.main_task = asyncio.current_task()
+        try:
+            await self._monitor()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.manager.watcher.stop()
+
+    async def _monitor(self):
+        m = self.manager
+        watching = m.start_watching()
+        print(f"⚡ Async monitor engine ({self.max_workers} I/O workers)")
+        last_scan = 0
+        wait = m.scheduler.next_wait()
+
+        while m.auto_monitor_running:
+            try:
+                # In watch mode, block until an event arrives or the interval passes
+                events = await self._call(m.watcher.get_events, timeout=wait) if watching else []
+
+                if watching and not m.watcher.is_healthy():
+                    print("⚠️ File watcher lost events - running full scan")
+                    m.watcher.reset()
+                    last_scan = 0
+
+                # One heartbeat per cycle keeps all of our locks alive
+                sw_running, _ = await asyncio.gather(self._call(m.is_solidworks_running),
+                                                     self._call(m.lock_store.beat, m.user, m.computer))
+                changed = bool(events)
+                if sw_running:
+                    scan_due = time.time() - last_scan >= m.watch_rescan_interval
+                    if not watching or scan_due or m.detection_method == 'process_handles':
+                        changed = await self._sync(events, scan_due) or changed
+                        if scan_due:
+                            last_scan = time.time()
+                    elif events:
+                        await self._call(m.handle_watch_events, events)
+                else:
+                    # SolidWorks not running - clean up all our auto-locks
+                    removed = await self._call(m.cleanup_stale_locks, max_hours=0, force_cleanup_my_locks=True)
+                    m.synced_files = {}
+                    m.synced_locks = set()
+                    if removed > 0:
+                        print(f"🧹 SolidWorks closed - cleaned up {removed} auto-locks")
+
+                # Run due foreground tasks, hand slow ones to the worker thread
+                await self._call(m.tasks.run_due)
+
+                # Sooner after activity, later while quiet
+                last_interval = m.scheduler.interval
+                m.scheduler.update(sw_running, changed)
+                wait = m.scheduler.next_wait()
+                if m.scheduler.interval != last_interval:
+                    print(f"⏱️ Checking every {m.scheduler.interval:g}s (next in {wait:.1f}s)")
+
+                # Wait before next check, or until SolidWorks exits
+                if not watching:
+                    await self._call(m.watcher.get_events, timeout=wait)
+
+            except Exception as e:
+                print(f"Error in auto-monitor: {e}")
+                await asyncio.sleep(5)
+
+    async def _sync(self, events, cross_check):
+        """Detect open files and acquire or release their locks concurrently"""
+        m = self.manager
+
+        # Lock files from watcher events while the scan runs
+        jobs = [self._call(m.detect_open_files, cross_check)]
+        if events:
+            jobs.append(self._call(m.handle_watch_events, events))
+        open_files = (await asyncio.gather(*jobs))[0]
+
+        if cross_check:
+            # The steps of reconcile_open_files, with the acquires overlapped
+            await self._call(m.start_reconcile)
+            await asyncio.gather(*(self._call(m.lock_opened_file, file_path, method)
+                                   for file_path, method in open_files.items()))
+            await self._call(m.release_unopened_locks, open_files)
+        else:
+            closed = list(m.synced_files.keys() - open_files.keys())
+            opened = list(open_files.keys() - m.synced_files.keys())
+            results = await asyncio.gather(*(self._call(m.release_closed_file, file_path) for file_path in closed),
+                                           *(self._call(m.lock_opened_file, file_path, open_files[file_path])
+                                             for file_path in opened))
+            for file_path, released in zip(closed, results):
+                if not released:
+                    # Missed by a partial scan, still open
+                    open_files[file_path] = m.synced_files[file_path]
+
+        return m.finish_sync(open_files)
@@ -0,0 +1,125 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+# Import time budget for one-shot commands, in milliseconds, on top of what
+# a bare interpreter imports (site, encodings) measured alongside each run.
+# The monitor commands load the scanner, watcher and psutil and aren't held
+# to it.
+STARTUP_TARGET_MS = 35
+RUNS = 7
+
+# Timings vary from run to run, so a command is only reported slow above the
+# target and fails the run above target * HEADROOM
+HEADROOM = 2
+
+# Modules one-shot commands must never import; unlike the timings this
+# check gives the same answer every run
+MONITOR_MODULES = {'psutil', 'watchdog', 'scanner', 'watcher', 'sw_process', 'scheduler', 'async_monitor'}
+
+INSTALL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (label, script, arguments); {file} is replaced by a scratch CAD file
+ACTIONS = [
+    ('check', 'main.py', ['check', '{file}']),
+    ('lock', 'main.py', ['lock', '{file}']),
+    ('unlock', 'main.py', ['unlock', '{file}']),
+    ('open', 'main.py', ['open', '{file}']),
+    ('unlock-all', 'main.py', ['unlock-all']),
+    ('cleanup', 'main.py', ['cleanup']),
+    ('agent open (no agent)', 'agent.py', ['open', '{file}']),
+]
+
+
+def parse_importtime(output):
+    """Return (total microseconds, [(cumulative us, module)] for top-level imports, all module names)"""
+    total = 0
+    top_level = []
+    modules = set()
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        cumulative = cumulative.strip()
+        name = name[1:]
+        if not cumulative.isdigit():
+            continue
+        modules.add(name.strip())
+        # Nested imports are indented under the module that pulled them in
+        if not name.startswith(' '):
+            total += int(cumulative)
+            top_level.append((int(cumulative), name))
+    return total, sorted(top_level, reverse=True), modules
+
+
+def run_action(script, args, env):
+    """Run one CLI action with -X importtime, returns its parsed import times"""
+    if script is None:
+        command = [sys.executable, '-X', 'importtime', '-c', 'pass']
+    else:
+        command = [sys.executable, '-X', 'importtime', os.path.join(INSTALL_DIR, script)] + args
+    result = subprocess.run(command, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True, timeout=60)
+    return parse_importtime(result.stderr)
+
+
+def measure(script, args, env):
+    """Return (median ms over a bare interpreter, median run's top-level imports,
+    monitor modules loaded in every run)
+
+    Each run is paired with a bare interpreter run, so both see the same
+    machine load.
+    """
+    results = []
+    for _ in range(RUNS):
+        baseline = run_action(None, [], env)[0]
+        result = run_action(script, args, env)
+        results.append((result[0] - baseline, result))
+    results.sort(key=lambda pair: pair[0])
+    extra_us, median = results[len(results) // 2]
+    loaded = MONITOR_MODULES.intersection(*(result[2] for _, result in results))
+    return extra_us / 1000, median[1], loaded
+
+
+def main():
+    target_ms = float(sys.argv[1]) if len(sys.argv) > 1 else STARTUP_TARGET_MS
+
+    with tempfile.TemporaryDirectory() as scratch:
+        cad_root = os.path.join(scratch, 'cad')
+        os.makedirs(cad_root)
+        file_path = os.path.join(cad_root, 'bench.sldprt')
+        open(file_path, 'w').close()
+
+        # Scratch lock folder and state, and no SolidWorks to launch
+        env = dict(os.environ, CAD_ROOT_DIR=cad_root, LOCK_DIR=os.path.join(cad_root, 'Locks'),
+                   CADLOCK_STATE_DIR=os.path.join(scratch, 'state'),
+                   SOLIDWORKS_PATH=os.path.join(scratch, 'SLDWORKS.exe'),
+                   USER_OVERRIDE='bench', COMPUTER_OVERRIDE='bench')
+
+        print(f"Import time per CLI action over a bare interpreter (median of {RUNS}, "
+              f"target {target_ms:g} ms, fails over {target_ms * HEADROOM:g} ms)")
+        failed = []
+        for label, script, args in ACTIONS:
+            args = [arg.replace('{file}', file_path) for arg in args]
+            total_ms, top_level, loaded = measure(script, args, env)
+            heaviest = ', '.join(f"{name} {us / 1000:.1f}" for us, name in top_level[:3])
+            if loaded:
+                status = 'LOADS ' + ', '.join(sorted(loaded))
+            elif total_ms > target_ms * HEADROOM:
+                status = 'OVER'
+            elif total_ms > target_ms:
+                status = 'slow'
+            else:
+                status = 'ok'
+            print(f"  {label:<22} {total_ms:6.1f} ms  {status:<4}  ({heaviest})")
+            if loaded or total_ms > target_ms * HEADROOM:
+                failed.append(label)
+
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
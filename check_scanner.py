@@ -0,0 +1,160 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from scanner import DEFAULT_EXCLUDE_GLOBS, ExclusionRules, IncrementalScanner, is_cad_temp_file
+
+ROUNDS = 30
+SEED = 1
+
+# (label, workers)
+MODES = [
+    ('serial', 1),
+    ('parallel', 8),
+]
+
+# Listings older than this are trusted by the scanner's mtime cache
+SETTLED_AGE = 60
+
+
+def expected_open_files(root, rules):
+    """Return the open CAD documents under root found by a plain os.walk"""
+    found = set()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not rules.excludes(os.path.join(dirpath, d), d)]
+        names = {name.lower() for name in filenames}
+        for name in filenames:
+            if is_cad_temp_file(name) and name[2:].lower() in names:
+                found.add(os.path.join(dirpath, name[2:]))
+    return found
+
+
+def settle(root, when):
+    """Backdate every folder's mtime so the scanner trusts its cached listing
+
+    Folders keep the same mtime from round to round unless they changed, so
+    unchanged folders are reused from the cache.
+    """
+    for dirpath, _, _ in os.walk(root):
+        os.utime(dirpath, (when, when))
+
+
+def all_dirs(root):
+    return [dirpath for dirpath, _, _ in os.walk(root)]
+
+
+def all_files(root):
+    return [os.path.join(dirpath, name) for dirpath, _, filenames in os.walk(root) for name in filenames]
+
+
+def add_document(rng, root, opened):
+    """Create a CAD document, with its ~$ temp file if opened"""
+    folder = rng.choice(all_dirs(root))
+    name = f"part{rng.randrange(100000)}{rng.choice(['.sldprt', '.SLDASM', '.slddrw', '.txt'])}"
+    open(os.path.join(folder, name), 'w').close()
+    if opened:
+        open(os.path.join(folder, '~$' + name), 'w').close()
+
+
+def mutate(rng, root):
+    """Apply one random change to the tree, returns a description of it"""
+    dirs = all_dirs(root)[1:]
+    files = all_files(root)
+    temp_files = [f for f in files if os.path.basename(f).startswith('~$')]
+    action = rng.choice(['add dir', 'remove dir', 'rename dir', 'open', 'close', 'delete original',
+                         'add document', 'excluded temp'])
+
+    if action == 'add dir':
+        parent = rng.choice(all_dirs(root))
+        folder = os.path.join(parent, f"dir{rng.randrange(100000)}")
+        os.makedirs(folder)
+        open(os.path.join(folder, 'new.sldprt'), 'w').close()
+        open(os.path.join(folder, '~$new.sldprt'), 'w').close()
+    elif action == 'remove dir' and dirs:
+        shutil.rmtree(rng.choice(dirs))
+    elif action == 'rename dir' and dirs:
+        folder = rng.choice(dirs)
+        os.rename(folder, os.path.join(os.path.dirname(folder), f"moved{rng.randrange(100000)}"))
+    elif action == 'open':
+        add_document(rng, root, opened=True)
+    elif action == 'close' and temp_files:
+        os.remove(rng.choice(temp_files))
+    elif action == 'delete original' and temp_files:
+        temp_file = rng.choice(temp_files)
+        original = os.path.join(os.path.dirname(temp_file), os.path.basename(temp_file)[2:])
+        if os.path.exists(original):
+            os.remove(original)
+    elif action == 'add document':
+        add_document(rng, root, opened=False)
+    elif action == 'excluded temp':
+        folder = os.path.join(rng.choice(all_dirs(root)), '.git')
+        os.makedirs(folder, exist_ok=True)
+        open(os.path.join(folder, 'hidden.sldprt'), 'w').close()
+        open(os.path.join(folder, '~$hidden.sldprt'), 'w').close()
+    else:
+        return None
+    return action
+
+
+def build_tree(rng, root):
+    """Create a few levels of folders with open and closed documents"""
+    for top in range(4):
+        for sub in range(3):
+            os.makedirs(os.path.join(root, f"project{top}", f"sub{sub}", 'parts'))
+    for _ in range(40):
+        add_document(rng, root, opened=rng.random() < 0.3)
+
+
+def check_mode(label, workers, scratch):
+    """Mutate a tree between scans and compare each scan with os.walk, returns the mismatches"""
+    rng = random.Random(SEED)
+    root = os.path.join(scratch, label)
+    os.makedirs(root)
+    build_tree(rng, root)
+    settled = time.time() - SETTLED_AGE
+    settle(root, settled)
+
+    rules = ExclusionRules(root, DEFAULT_EXCLUDE_GLOBS.split(';'))
+    scanner = IncrementalScanner(root, full_rescan_interval=3600, workers=workers, rules=rules)
+    failures = []
+    listed = reused = 0
+    try:
+        for round_number in range(ROUNDS + 1):
+            action = mutate(rng, root) if round_number else 'initial scan'
+            if action is None:
+                continue
+            result = scanner.scan()
+            expected = expected_open_files(root, rules)
+            listed += scanner.dirs_listed
+            reused += scanner.dirs_reused
+            if result != expected:
+                failures.append((round_number, action, sorted(expected - result), sorted(result - expected)))
+            settle(root, settled)
+    finally:
+        scanner.close()
+
+    print(f"  {label:<10} workers={workers:<2} {ROUNDS} rounds, {listed} listed, {reused} reused, "
+          f"{'ok' if not failures else 'MISMATCH'}")
+    if not reused:
+        failures.append((None, 'the mtime cache was never used', [], []))
+    return failures
+
+
+def main():
+    print("IncrementalScanner vs os.walk on a mutating tree")
+    failed = False
+    with tempfile.TemporaryDirectory() as scratch:
+        for label, workers in MODES:
+            for round_number, action, missing, extra in check_mode(label, workers, scratch):
+                failed = True
+                print(f"    round {round_number} ({action}): missing {missing}, unexpected {extra}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
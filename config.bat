@@ -16,8 +16,70 @@ REM Lock directory (usually inside CAD_ROOT_DIR)
 set "LOCK_DIR=%CAD_ROOT_DIR%\Locks"
 
 REM Advanced Settings (usually don't need to change)
+REM Lock lease length: a lock expires this long after its holder's last heartbeat
 set "CLEANUP_MAX_HOURS=24"
+REM Monitor cycle: MONITOR_MIN_INTERVAL seconds right after activity, doubling each
+REM quiet cycle up to MONITOR_INTERVAL (SolidWorks open) or MONITOR_IDLE_INTERVAL (closed).
+REM MONITOR_JITTER spreads computers apart (0.2 = +/-20%)
 set "MONITOR_INTERVAL=10"
+set "MONITOR_MIN_INTERVAL=2"
+set "MONITOR_IDLE_INTERVAL=60"
+set "MONITOR_JITTER=0.2"
+REM Background tasks: expired lock cleanup (CLI monitor) and conflict scan (tray, also on lock folder change)
+set "CLEANUP_INTERVAL=300"
+set "CONFLICT_SCAN_INTERVAL=60"
+REM 1 = the tray answers open-cad.bat's lock requests itself (0 = every open runs main.py)
+set "AGENT_ENABLED=1"
+REM Seconds between full CAD tree rescans (incremental scans in between)
+set "FULL_RESCAN_INTERVAL=600"
+REM Folders listed in parallel during a scan (network latency bound, not CPU)
+set "SCAN_WORKERS=8"
+REM Seconds between checks of hot folders and of cold subtrees (0 = every cycle; a cold
+REM interval delays locking files opened in quiet folders, so raise it only in watch mode)
+set "HOT_SCAN_INTERVAL=0"
+set "COLD_SCAN_INTERVAL=0"
+REM Max seconds of folder scanning per cycle; longer walks resume next cycle
+set "SCAN_BUDGET_SECONDS=2"
+REM Folders never scanned, ';'-separated. Globs match folder names, or paths
+REM relative to CAD_ROOT_DIR if they contain a slash. The Locks folder is always skipped.
+REM Only exclude folders nobody edits in: a glob like *Released* also skips "Unreleased".
+REM Site-specific example: .git;.svn;$RECYCLE.BIN;System Volume Information;Archive;Backups
+set "SCAN_EXCLUDE_GLOBS=.git;.svn;$RECYCLE.BIN;System Volume Information"
+set "SCAN_EXCLUDE_PATHS="
+REM watch = react to temp file events (needs watchdog), poll = scan every cycle
+set "MONITOR_MODE=watch"
+REM CLI monitor engine: thread = one step at a time, asyncio = overlap scans, lock I/O and
+REM process checks on MONITOR_IO_WORKERS threads
+set "MONITOR_ENGINE=thread"
+set "MONITOR_IO_WORKERS=8"
+REM Seconds between safety-net scans (watch mode) and cross-checks (process_handles)
+set "WATCH_RESCAN_INTERVAL=300"
+REM temp_file = look for ~$ files, process_handles = read files SolidWorks holds open
+set "DETECTION_METHOD=temp_file"
+REM Seconds between full process listings once SolidWorks has been found (its PIDs are checked in between)
+set "PROCESS_RESCAN_INTERVAL=60"
+REM file = one .lock file per lock, journal = one append-only log (all computers must match),
+REM sqlite = SQLite database on this computer's local disk, for single-computer setups only
+REM (LOCK_DB_PATH overrides the default locks.db in the local state folder; never put it on the shared drive)
+set "LOCK_BACKEND=file"
+set "LOCK_DB_PATH="
+REM LOCK_BACKEND=server sends lock requests to the dashboard at LOCK_SERVER_URL
+REM (falls back to the Locks folder when it can't be reached)
+set "LOCK_SERVER_URL="
+set "LOCK_SERVER_TIMEOUT=2"
+REM Set to 1 on the dashboard computer to make it the lock server
+set "LOCK_SERVER=0"
+REM Journal records before they are compacted into a snapshot
+set "JOURNAL_COMPACT_RECORDS=500"
+REM Lock file format: 1 = original, readable by every version. Set 2 (compact, epoch
+REM timestamps) only once every computer runs a version that reads it.
+set "LOCK_RECORD_VERSION=1"
+REM Lock folder layout (file backend): flat = every lock in the Locks folder,
+REM project = Locks\Shards\<top-level folder>, hash = Locks\Shards\<2 hex digits>.
+REM Clients find locks in any layout; after switching, run "main.py migrate-locks" once
+set "LOCK_LAYOUT=flat"
+REM Dashboard marks a lock stale when its holder's heartbeat is older than this
+set "HEARTBEAT_STALE_SECONDS=120"
 set "DASHBOARD_HOST=0.0.0.0" 
 set "DASHBOARD_PORT=5000"
 
@@ -1,11 +1,13 @@
 import os
-import json
 import time
 from datetime import datetime
-from flask import Flask, render_template_string, jsonify
+from flask import Flask, render_template_string, jsonify, request
 from pathlib import Path
 import threading
 
+from heartbeat import last_alive, lease_expiry
+from lock_store import open_lock_store
+
 # Load environment variables
 def load_env_file():
     """Load environment variables from .env file"""
@@ -30,66 +32,86 @@ class LockDashboard:
         self.cad_root = os.getenv('CAD_ROOT_DIR', r"G:\Shared drives\Cosmic\Engineering\50 - CAD Data")
         
         # Get settings
-        self.cleanup_max_hours = int(os.getenv('CLEANUP_MAX_HOURS', '24'))
+        self.cleanup_max_hours = float(os.getenv('CLEANUP_MAX_HOURS', '24'))
+        self.heartbeat_stale_seconds = int(os.getenv('HEARTBEAT_STALE_SECONDS', '120'))
+        
+        # 'file' keeps one .lock file per lock, 'journal' an append-only log
+        self.lock_backend = os.getenv('LOCK_BACKEND', 'file').lower()
+        
+        # With LOCK_SERVER=1 this process is the lock server for clients using
+        # LOCK_BACKEND=server. It keeps its own locks in the lock folder, so
+        # clients that can't reach it fall back to the same files.
+        self.lock_server = os.getenv('LOCK_SERVER', '0') == '1'
+        if self.lock_backend == 'server':
+            self.lock_backend = 'file'
+        self.lock_layout = os.getenv('LOCK_LAYOUT', 'flat').lower()
+        self.lock_store = open_lock_store(self.lock_dir, self.lock_backend, self.lock_layout)
+        self.store_lock = threading.Lock()
     
     def get_all_locks(self):
         """Get all current lock files and their information"""
         locks = []
         
-        if not os.path.exists(self.lock_dir):
-            return locks
-        
         try:
-            for lock_file in os.listdir(self.lock_dir):
-                if lock_file.endswith('.lock'):
-                    lock_path = os.path.join(self.lock_dir, lock_file)
-                    try:
-                        with open(lock_path, 'r') as f:
-                            lock_data = json.load(f)
-                        
-                        # Calculate time since lock was created
-                        lock_time = datetime.strptime(lock_data['timestamp'], "%Y-%m-%d %H:%M:%S")
-                        time_diff = datetime.now() - lock_time
-                        
-                        # Format duration
-                        hours, remainder = divmod(int(time_diff.total_seconds()), 3600)
-                        minutes, seconds = divmod(remainder, 60)
-                        
-                        if hours > 0:
-                            duration = f"{hours}h {minutes}m"
-                        elif minutes > 0:
-                            duration = f"{minutes}m {seconds}s"
-                        else:
-                            duration = f"{seconds}s"
-                        
-                        # Check if original file still exists
-                        file_exists = os.path.exists(lock_data.get('original_path', ''))
-                        
-                        locks.append({
-                            'file': lock_data.get('file', 'Unknown'),
-                            'user': lock_data.get('user', 'Unknown'),
-                            'computer': lock_data.get('computer', 'Unknown'),
-                            'timestamp': lock_data.get('timestamp', 'Unknown'),
-                            'duration': duration,
-                            'original_path': lock_data.get('original_path', ''),
-                            'lock_file': lock_file,
-                            'file_exists': file_exists,
-                            'lock_time_obj': lock_time
-                        })
+            heartbeats = self.lock_store.heartbeats()
+            for lock_file, lock_data in self.lock_store.all():
+                try:
+                    if lock_data is None:
+                        raise ValueError("unreadable lock data")
+                    
+                    # Calculate time since lock was created
+                    if not lock_data.get('locked_at'):
+                        raise ValueError("lock has no timestamp")
+                    lock_time = datetime.fromtimestamp(lock_data['locked_at'])
+                    time_diff = datetime.now() - lock_time
+                    
+                    # Format duration
+                    hours, remainder = divmod(int(time_diff.total_seconds()), 3600)
+                    minutes, seconds = divmod(remainder, 60)
+                    
+                    if hours > 0:
+                        duration = f"{hours}h {minutes}m"
+                    elif minutes > 0:
+                        duration = f"{minutes}m {seconds}s"
+                    else:
+                        duration = f"{seconds}s"
                     
-                    except (json.JSONDecodeError, KeyError, ValueError) as e:
-                        # Handle corrupted lock files
-                        locks.append({
-                            'file': lock_file,
-                            'user': 'CORRUPTED',
-                            'computer': 'CORRUPTED',
-                            'timestamp': 'CORRUPTED',
-                            'duration': 'CORRUPTED',
-                            'original_path': '',
-                            'lock_file': lock_file,
-                            'file_exists': False,
-                            'lock_time_obj': datetime.now()
-                        })
+                    # Check if original file still exists
+                    file_exists = os.path.exists(lock_data.get('original_path', ''))
+                    
+                    # Holder liveness comes from their heartbeat, not the lock file
+                    alive_at = last_alive(lock_data, heartbeats, self.lock_store.get_mtime(lock_file))
+                    stale = time.time() - alive_at > self.heartbeat_stale_seconds
+                    
+                    locks.append({
+                        'file': lock_data.get('file', 'Unknown'),
+                        'user': lock_data.get('user', 'Unknown'),
+                        'computer': lock_data.get('computer', 'Unknown'),
+                        'timestamp': lock_data.get('timestamp', 'Unknown'),
+                        'duration': duration,
+                        'original_path': lock_data.get('original_path', ''),
+                        'lock_file': lock_file,
+                        'file_exists': file_exists,
+                        'last_seen': datetime.fromtimestamp(alive_at).strftime("%Y-%m-%d %H:%M:%S"),
+                        'stale': stale,
+                        'lock_time_obj': lock_time
+                    })
+                
+                except (KeyError, ValueError) as e:
+                    # Handle corrupted lock files
+                    locks.append({
+                        'file': lock_file,
+                        'user': 'CORRUPTED',
+                        'computer': 'CORRUPTED',
+                        'timestamp': 'CORRUPTED',
+                        'duration': 'CORRUPTED',
+                        'original_path': '',
+                        'lock_file': lock_file,
+                        'file_exists': False,
+                        'last_seen': 'CORRUPTED',
+                        'stale': True,
+                        'lock_time_obj': datetime.now()
+                    })
         
         except Exception as e:
             print(f"Error reading lock directory: {e}")
@@ -99,31 +121,23 @@ class LockDashboard:
         return locks
     
     def cleanup_stale_locks(self, max_hours=None):
-        """Remove lock files older than specified hours"""
+        """Remove locks whose lease ran out, max_hours after their holder was last seen"""
         if max_hours is None:
             max_hours = self.cleanup_max_hours
             
         removed_count = 0
         
-        if not os.path.exists(self.lock_dir):
-            return removed_count
-        
         try:
-            for lock_file in os.listdir(self.lock_dir):
-                if lock_file.endswith('.lock'):
-                    lock_path = os.path.join(self.lock_dir, lock_file)
-                    try:
-                        # Check file modification time
-                        file_time = datetime.fromtimestamp(os.path.getmtime(lock_path))
-                        age_hours = (datetime.now() - file_time).total_seconds() / 3600
-                        
-                        if age_hours > max_hours:
-                            os.remove(lock_path)
-                            removed_count += 1
-                            print(f"Removed stale lock: {lock_file}")
-                    
-                    except Exception as e:
-                        print(f"Error processing {lock_file}: {e}")
+            # Only expired leases come back, not every lock
+            heartbeats = self.lock_store.heartbeats()
+            for lock_file, lock_data in self.lock_store.expired(heartbeats, max_hours * 3600):
+                try:
+                    self.lock_store.remove(self.lock_store.lock_path(lock_file))
+                    removed_count += 1
+                    print(f"Removed stale lock: {lock_file}")
+                
+                except Exception as e:
+                    print(f"Error processing {lock_file}: {e}")
         
         except Exception as e:
             print(f"Error during cleanup: {e}")
@@ -439,6 +453,10 @@ HTML_TEMPLATE = """
                                     <span class="detail-label">Locked Since</span>
                                     <span class="detail-value">${lock.timestamp}</span>
                                 </div>
+                                <div class="detail-item">
+                                    <span class="detail-label">Last Seen</span>
+                                    <span class="detail-value">${lock.last_seen}${lock.stale ? ' (stale)' : ''}</span>
+                                </div>
                                 <div class="detail-item">
                                     <span class="detail-label">File Path</span>
                                     <span class="detail-value file-path">${lock.original_path}</span>
@@ -532,6 +550,10 @@ HTML_TEMPLATE = """
                             <span class="detail-label">Locked Since</span>
                             <span class="detail-value">{{ lock.timestamp }}</span>
                         </div>
+                        <div class="detail-item">
+                            <span class="detail-label">Last Seen</span>
+                            <span class="detail-value">{{ lock.last_seen }}{% if lock.stale %} (stale){% endif %}</span>
+                        </div>
                         <div class="detail-item">
                             <span class="detail-label">File Path</span>
                             <span class="detail-value file-path">{{ lock.original_path }}</span>
@@ -578,12 +600,156 @@ def api_locks():
 @app.route('/api/cleanup', methods=['POST'])
 def api_cleanup():
     """API endpoint for cleaning up stale locks"""
-    removed_count = lock_manager.cleanup_stale_locks(max_hours=24)
+    removed_count = lock_manager.cleanup_stale_locks()
     return jsonify({
         'removed_count': removed_count,
         'timestamp': datetime.now().isoformat()
     })
 
+def _store_reply(locks):
+    """Format [(name, lock data)] for lock server clients"""
+    return jsonify({
+        'locks': [[name, lock_data, lock_manager.lock_store.get_mtime(name)]
+                  for name, lock_data in locks if lock_data is not None]
+    })
+
+def _store_request():
+    """Return (lock path, lock data) from a lock server request, or None if malformed"""
+    payload = request.get_json(silent=True) or {}
+    name = os.path.basename(payload.get('name', ''))
+    if not name.endswith('.lock'):
+        return None
+    return lock_manager.lock_store.lock_path(name), payload.get('lock')
+
+def _caller(payload):
+    """Return (user, computer) of the client making a lock server request"""
+    return payload.get('user'), payload.get('computer')
+
+def _may_release(lock_path, lock_data, caller):
+    """Return True if the caller holds the lock, or its lease has run out"""
+    if lock_data.get('user') == caller[0]:
+        return True
+    store = lock_manager.lock_store
+    expires_at = lease_expiry(lock_data, store.heartbeats(), lock_manager.cleanup_max_hours * 3600,
+                              store.get_mtime(os.path.basename(lock_path)))
+    return expires_at <= time.time()
+
+@app.route('/api/store/locks')
+def api_store_locks():
+    """Lock server: list locks, optionally by user, computer, path, conflicts or expired leases only"""
+    if not lock_manager.lock_server:
+        return jsonify({'error': 'lock server disabled'}), 503
+    
+    store = lock_manager.lock_store
+    if request.args.get('user'):
+        locks = store.for_user(request.args['user'])
+    elif request.args.get('computer'):
+        locks = store.for_computer(request.args['computer'])
+    elif request.args.get('normalized_path'):
+        locks = store.for_normalized_path(request.args['normalized_path'])
+    elif request.args.get('conflicts'):
+        locks = [lock for group in store.conflicts().values() for lock in group]
+    elif request.args.get('expired'):
+        try:
+            lease_seconds = float(request.args['expired'])
+        except ValueError:
+            return jsonify({'error': 'bad request'}), 400
+        locks = store.expired(store.heartbeats(), lease_seconds)
+    else:
+        locks = store.all()
+    return _store_reply(locks)
+
+@app.route('/api/store/lock')
+def api_store_lock():
+    """Lock server: get one lock by name"""
+    if not lock_manager.lock_server:
+        return jsonify({'error': 'lock server disabled'}), 503
+    
+    name = os.path.basename(request.args.get('name', ''))
+    lock_data = lock_manager.lock_store.get(lock_manager.lock_store.lock_path(name)) if name else None
+    if lock_data is None:
+        return jsonify({'error': 'no such lock'}), 404
+    return jsonify({'lock': lock_data})
+
+@app.route('/api/store/acquire', methods=['POST'])
+def api_store_acquire():
+    """Lock server: create a lock unless someone holds it"""
+    if not lock_manager.lock_server:
+        return jsonify({'error': 'lock server disabled'}), 503
+    lock_request = _store_request()
+    if lock_request is None or not isinstance(lock_request[1], dict):
+        return jsonify({'error': 'bad request'}), 400
+    
+    # One acquire at a time, so two clients can't both win
+    with lock_manager.store_lock:
+        acquired, lock_data = lock_manager.lock_store.acquire(*lock_request)
+    return jsonify({'acquired': acquired, 'lock': lock_data})
+
+@app.route('/api/store/renew', methods=['POST'])
+def api_store_renew():
+    """Lock server: create or overwrite a lock"""
+    if not lock_manager.lock_server:
+        return jsonify({'error': 'lock server disabled'}), 503
+    lock_request = _store_request()
+    if lock_request is None or not isinstance(lock_request[1], dict):
+        return jsonify({'error': 'bad request'}), 400
+    
+    # Only the holder may rewrite a lock, and only as itself
+    caller = _caller(request.get_json(silent=True) or {})
+    lock_path, lock_data = lock_request
+    if not caller[0] or lock_data.get('user') != caller[0]:
+        return jsonify({'error': 'not your lock'}), 403
+    
+    with lock_manager.store_lock:
+        existing = lock_manager.lock_store.get(lock_path)
+        if existing is not None and existing.get('user') != caller[0]:
+            return jsonify({'error': 'locked by someone else', 'lock': existing}), 409
+        lock_manager.lock_store.write(lock_path, lock_data)
+    return jsonify({'ok': True})
+
+@app.route('/api/store/heartbeat', methods=['POST'])
+def api_store_heartbeat():
+    """Lock server: record that a user's monitor is alive"""
+    if not lock_manager.lock_server:
+        return jsonify({'error': 'lock server disabled'}), 503
+    payload = request.get_json(silent=True) or {}
+    if not payload.get('user') or not payload.get('computer'):
+        return jsonify({'error': 'bad request'}), 400
+    
+    lock_manager.lock_store.beat(payload['user'], payload['computer'])
+    return jsonify({'ok': True})
+
+@app.route('/api/store/heartbeats')
+def api_store_heartbeats():
+    """Lock server: last heartbeat of every user and computer"""
+    if not lock_manager.lock_server:
+        return jsonify({'error': 'lock server disabled'}), 503
+    return jsonify({'heartbeats': lock_manager.lock_store.heartbeats()})
+
+@app.route('/api/store/release', methods=['POST'])
+def api_store_release():
+    """Lock server: remove a lock"""
+    if not lock_manager.lock_server:
+        return jsonify({'error': 'lock server disabled'}), 503
+    lock_request = _store_request()
+    if lock_request is None:
+        return jsonify({'error': 'bad request'}), 400
+    
+    caller = _caller(request.get_json(silent=True) or {})
+    if not caller[0]:
+        return jsonify({'error': 'not your lock'}), 403
+    
+    try:
+        with lock_manager.store_lock:
+            # Holders release their own locks; anyone may clear an expired lease
+            existing = lock_manager.lock_store.get(lock_request[0])
+            if existing is not None and not _may_release(lock_request[0], existing, caller):
+                return jsonify({'error': 'not your lock', 'lock': existing}), 403
+            lock_manager.lock_store.remove(lock_request[0])
+    except FileNotFoundError:
+        return jsonify({'error': 'no such lock'}), 404
+    return jsonify({'ok': True})
+
 def run_server():
     """Run the Flask server"""
     # Get server settings from environment
@@ -594,6 +760,8 @@ def run_server():
     print(f"Dashboard will be available at: http://localhost:{port}")
     if host == '0.0.0.0':
         print(f"Network access available at: http://your-ip:{port}")
+    if lock_manager.lock_server:
+        print(f"Lock server enabled at: http://your-ip:{port}/api/store (backend: {lock_manager.lock_backend})")
     print("Press Ctrl+C to stop the server")
     
     try:
@@ -0,0 +1,89 @@
+import json
+import os
+import time
+
+from lock_paths import SAFE_NAME_TABLE
+
+# Liveness lives in one small file per user and computer, rewritten once per
+# monitor cycle, instead of in every lock's last_seen. Lock files are then
+# only written on acquire and release.
+HEARTBEAT_DIR = 'Heartbeats'
+
+
+def heartbeat_key(user, computer):
+    """Return the file-safe name identifying a user on a computer"""
+    return f"{user}@{computer}".translate(SAFE_NAME_TABLE)
+
+
+def last_alive(lock_data, heartbeats, mtime=None):
+    """Return when the holder of a lock was last known alive (seconds)
+
+    That is the holder's latest heartbeat, or failing that when the lock was
+    written or last renewed, whichever is newest.
+    """
+    return max(mtime or 0,
+               heartbeats.get(heartbeat_key(lock_data.get('user'), lock_data.get('computer')), 0),
+               lock_data.get('locked_at') or 0,
+               lock_data.get('seen_at') or 0)
+
+
+def lease_expiry(lock_data, heartbeats, lease_seconds, mtime=None):
+    """Return when a lock's lease runs out (seconds)
+
+    A lease lasts lease_seconds from when its holder was last alive, so each
+    heartbeat extends it.
+    """
+    return last_alive(lock_data, heartbeats, mtime) + lease_seconds
+
+
+class HeartbeatFiles:
+    """Heartbeat files in <lock dir>/Heartbeats, used by the file and journal backends"""
+
+    def __init__(self, lock_dir, interval=10):
+        self.heartbeat_dir = os.path.join(lock_dir, HEARTBEAT_DIR)
+        self.interval = interval
+
+        # Heartbeat key -> when we last wrote it
+        self.last_beats = {}
+
+    def beat(self, user, computer, force=False):
+        """Record that user's monitor on computer is alive, at most once per interval"""
+        now = time.time()
+        key = heartbeat_key(user, computer)
+        if not force and now - self.last_beats.get(key, 0) < self.interval:
+            return False
+
+        path = os.path.join(self.heartbeat_dir, f"{key}.heartbeat")
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.heartbeat_dir, exist_ok=True)
+            with open(temp_path, 'w') as f:
+                json.dump({'user': user, 'computer': computer, 'timestamp': now}, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Could not write heartbeat: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return False
+
+        self.last_beats[key] = now
+        return True
+
+    def all(self):
+        """Return {heartbeat key: last beat (seconds)}"""
+        heartbeats = {}
+        try:
+            with os.scandir(self.heartbeat_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.heartbeat'):
+                        continue
+                    try:
+                        with open(entry.path, 'r') as f:
+                            heartbeats[entry.name[:-len('.heartbeat')]] = float(json.load(f)['timestamp'])
+                    except (OSError, ValueError, KeyError, TypeError):
+                        continue
+        except OSError:
+            pass
+        return heartbeats
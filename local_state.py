@@ -0,0 +1,65 @@
+import json
+import os
+import time
+
+# Per-user state that must not live on the shared drive (scan cursors,
+# recently opened files). Override with CADLOCK_STATE_DIR.
+RECENT_OPENS_FILE = 'recent_opens.json'
+
+
+def get_state_dir():
+    """Return the local per-user state directory, creating it if needed"""
+    state_dir = os.getenv('CADLOCK_STATE_DIR')
+    if not state_dir:
+        if os.getenv('LOCALAPPDATA'):
+            state_dir = os.path.join(os.getenv('LOCALAPPDATA'), 'CADLock')
+        else:
+            state_dir = os.path.join(os.path.expanduser('~'), '.cadlock')
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
+def load_state(name, default=None):
+    """Load a JSON state file, returning default if it is missing or corrupt"""
+    try:
+        with open(os.path.join(get_state_dir(), name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_state(name, data):
+    """Atomically write a JSON state file"""
+    path = os.path.join(get_state_dir(), name)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+        return True
+    except OSError as e:
+        print(f"Could not save {name}: {e}")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False
+
+
+def record_recent_open(file_path, max_entries=50):
+    """Remember that the user opened a file via 'main.py open'"""
+    recent = load_state(RECENT_OPENS_FILE, {})
+    recent[os.path.abspath(file_path)] = time.time()
+
+    if len(recent) > max_entries:
+        newest = sorted(recent.items(), key=lambda item: item[1], reverse=True)
+        recent = dict(newest[:max_entries])
+
+    save_state(RECENT_OPENS_FILE, recent)
+
+
+def load_recent_opens(max_age=3600):
+    """Return {file_path: opened_at} for files opened in the last max_age seconds"""
+    cutoff = time.time() - max_age
+    recent = load_state(RECENT_OPENS_FILE, {})
+    return {path: opened_at for path, opened_at in recent.items() if opened_at >= cutoff}
@@ -0,0 +1,342 @@
+import heapq
+import os
+import threading
+import time
+
+from heartbeat import lease_expiry
+from lock_paths import SHARD_DIR, candidate_paths, layout_path
+from lock_record import decode_record, decode_records
+
+
+def normalize_lock_path(file_path):
+    """Normalize a file path so different spellings of the same file compare equal"""
+    return os.path.normpath(file_path.lower())
+
+
+class LockIndex:
+    """In-memory view of the lock directory shared by the CLI, tray and dashboard
+
+    Each .lock file is parsed once and cached with the (mtime, size) it had
+    when read. A refresh re-lists the directory but only re-reads files whose
+    stat changed, so repeated lookups within one monitor cycle cost a single
+    listing. Refreshes within max_age seconds of the last one reuse it.
+    Corrupted lock files are kept with lock_data None so callers can report
+    or clean them up.
+
+    Locks are found in the flat lock folder and in Shards/<shard> folders
+    whatever the configured layout, so clients on different layouts see each
+    other's locks during a migration. A shard folder whose modified time
+    hasn't changed is not re-listed, and once every lock is where the layout
+    puts it, single-lock lookups only touch that one place.
+
+    Locks are leases. A min-heap orders them by when their holder was last
+    known alive, so finding expired leases only pops the front of the heap
+    instead of checking every lock.
+    """
+
+    def __init__(self, lock_dir, max_age=2.0, layout='flat'):
+        self.lock_dir = lock_dir
+        self.max_age = max_age
+        self.layout = layout
+        self.lock = threading.RLock()
+        self.last_refresh = 0
+
+        # lock file name -> (mtime_ns, size, lock_data or None)
+        self.entries = {}
+
+        # lock file name -> where it was found
+        self.paths = {}
+
+        # shard folder -> (mtime_ns, {name: path}) from its last listing
+        self.shard_listings = {}
+
+        # True while some lock is outside its place in the layout (or before
+        # the first refresh), so lookups must check every location
+        self.legacy_locations = True
+
+        # Secondary indexes: key -> set of lock file names
+        self.by_path = {}
+        self.by_user = {}
+        self.by_computer = {}
+        self.by_normalized = {}
+
+        # Lease heap of (last known alive, name); stale pairs are skipped
+        # when popped, lease_keys holds each lock's current one
+        self.lease_heap = []
+        self.lease_keys = {}
+
+        # Stats from the last refresh
+        self.files_read = 0
+
+    def _index_keys(self, lock_data):
+        """Return (index, key) pairs for a lock record"""
+        if not lock_data:
+            return []
+        keys = []
+        original_path = lock_data.get('original_path')
+        if original_path:
+            keys.append((self.by_path, original_path))
+            keys.append((self.by_normalized, normalize_lock_path(original_path)))
+        if lock_data.get('user'):
+            keys.append((self.by_user, lock_data['user']))
+        if lock_data.get('computer'):
+            keys.append((self.by_computer, lock_data['computer']))
+        return keys
+
+    def _put(self, name, mtime_ns, size, lock_data, path=None):
+        self._drop(name)
+        self.entries[name] = (mtime_ns, size, lock_data)
+        if path:
+            self.paths[name] = path
+        for index, key in self._index_keys(lock_data):
+            index.setdefault(key, set()).add(name)
+
+        alive_at = mtime_ns / 1e9
+        if lock_data:
+            alive_at = max(alive_at, lock_data.get('locked_at') or 0, lock_data.get('seen_at') or 0)
+        self._push_lease(name, alive_at)
+
+    def _push_lease(self, name, alive_at):
+        self.lease_keys[name] = alive_at
+        heapq.heappush(self.lease_heap, (alive_at, name))
+        if len(self.lease_heap) > 2 * len(self.lease_keys) + 64:
+            # Mostly stale pairs from rewritten locks, rebuild from lease_keys
+            self.lease_heap = [(key, name) for name, key in self.lease_keys.items()]
+            heapq.heapify(self.lease_heap)
+
+    def _drop(self, name):
+        self.paths.pop(name, None)
+        self.lease_keys.pop(name, None)
+        old = self.entries.pop(name, None)
+        if old is None:
+            return
+        for index, key in self._index_keys(old[2]):
+            names = index.get(key)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del index[key]
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return decode_record(f.read())
+        except OSError:
+            return None
+
+    def _list_dir(self, directory, found):
+        """Add {name: (path, stat)} for the .lock files in a directory"""
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.lock'):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                found[entry.name] = (entry.path, st)
+
+    def _list_shards(self, found):
+        """List shard folders, reusing listings of folders that haven't changed"""
+        shard_root = os.path.join(self.lock_dir, SHARD_DIR)
+        try:
+            shard_dirs = [entry.path for entry in os.scandir(shard_root) if entry.is_dir()]
+        except FileNotFoundError:
+            shard_dirs = []
+
+        listings = {}
+        for shard_dir in shard_dirs:
+            try:
+                dir_mtime = os.stat(shard_dir).st_mtime_ns
+            except OSError:
+                continue
+
+            cached = self.shard_listings.get(shard_dir)
+            if cached and cached[0] == dir_mtime:
+                listing = cached[1]
+            else:
+                listing = {}
+                try:
+                    self._list_dir(shard_dir, listing)
+                except OSError:
+                    continue
+            listings[shard_dir] = (dir_mtime, listing)
+
+            for name, (path, st) in listing.items():
+                # A lock in two places mid-migration: prefer the layout's place
+                if name not in found or path == layout_path(self.lock_dir, name, self.layout):
+                    found[name] = (path, st)
+        self.shard_listings = listings
+
+    def refresh(self, force=False):
+        """Re-list the lock directory, re-reading only lock files that changed"""
+        with self.lock:
+            if not force and time.time() - self.last_refresh < self.max_age:
+                return
+
+            found = {}
+            try:
+                self._list_dir(self.lock_dir, found)
+                self._list_shards(found)
+            except FileNotFoundError:
+                found = {}
+            except OSError as e:
+                print(f"Error reading lock directory: {e}")
+                return
+
+            changed = []
+            for name, (path, st) in found.items():
+                cached = self.entries.get(name)
+                if (cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size
+                        and self.paths.get(name) == path):
+                    continue
+                changed.append((name, path, st))
+
+            # Read every changed file first, then decode them in one pass
+            contents = []
+            for name, path, st in changed:
+                try:
+                    with open(path, 'rb') as f:
+                        contents.append(f.read())
+                except OSError:
+                    contents.append(b'')
+            for (name, path, st), lock_data in zip(changed, decode_records(contents)):
+                self._put(name, st.st_mtime_ns, st.st_size, lock_data, path)
+            self.files_read = len(changed)
+
+            for name in set(self.entries) - set(found):
+                self._drop(name)
+
+            self.legacy_locations = any(path != layout_path(self.lock_dir, name, self.layout)
+                                        for name, (path, st) in found.items())
+            self.last_refresh = time.time()
+
+    def note_written(self, lock_path, lock_data):
+        """Record a lock file we just wrote, so it isn't read back"""
+        with self.lock:
+            try:
+                st = os.stat(lock_path)
+            except OSError:
+                return
+            self._put(os.path.basename(lock_path), st.st_mtime_ns, st.st_size, lock_data, lock_path)
+
+    def note_removed(self, lock_path):
+        """Record a lock file we just deleted"""
+        with self.lock:
+            self._drop(os.path.basename(lock_path))
+
+    def lock_path(self, name):
+        """Return the full path of a lock file name, where it was last found"""
+        return self.paths.get(name) or layout_path(self.lock_dir, name, self.layout)
+
+    def _locations(self, lock_path):
+        """Return the paths to check for a lock, most likely first"""
+        name = os.path.basename(lock_path)
+        paths = [self.paths.get(name) or lock_path]
+        if self.legacy_locations:
+            others = candidate_paths(self.lock_dir, name, self.layout)
+        else:
+            others = [lock_path]
+        return paths + [path for path in others if path not in paths]
+
+    def get(self, lock_path, fresh=False):
+        """Return the lock data stored in a lock file, or None
+
+        fresh=True always stats the file instead of trusting a recent refresh.
+        """
+        name = os.path.basename(lock_path)
+        with self.lock:
+            if not fresh and time.time() - self.last_refresh < self.max_age:
+                entry = self.entries.get(name)
+                return entry[2] if entry else None
+
+            # Single lookup: stat just this file instead of listing the directory
+            for path in self._locations(lock_path):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+
+                cached = self.entries.get(name)
+                if (cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size
+                        and self.paths.get(name) == path):
+                    return cached[2]
+                lock_data = self._read(path)
+                self._put(name, st.st_mtime_ns, st.st_size, lock_data, path)
+                return lock_data
+
+            self._drop(name)
+            return None
+
+    def get_mtime(self, name):
+        """Return the modification time (seconds) of a lock file, or None"""
+        with self.lock:
+            entry = self.entries.get(name)
+            return entry[0] / 1e9 if entry else None
+
+    def all(self):
+        """Return [(lock file name, lock data or None)] for every lock file"""
+        self.refresh()
+        with self.lock:
+            return [(name, entry[2]) for name, entry in self.entries.items()]
+
+    def _lookup(self, index, key):
+        self.refresh()
+        with self.lock:
+            return [(name, self.entries[name][2]) for name in index.get(key, ())]
+
+    def for_path(self, file_path):
+        """Return locks whose original_path is exactly file_path"""
+        return self._lookup(self.by_path, file_path)
+
+    def for_normalized_path(self, file_path):
+        """Return locks on file_path, however the path was spelled"""
+        return self._lookup(self.by_normalized, normalize_lock_path(file_path))
+
+    def for_user(self, user):
+        """Return locks held by a user"""
+        return self._lookup(self.by_user, user)
+
+    def for_computer(self, computer):
+        """Return locks held from a computer"""
+        return self._lookup(self.by_computer, computer)
+
+    def normalized_paths(self):
+        """Return {normalized path: [(lock file name, lock data)]} for all locks"""
+        self.refresh()
+        with self.lock:
+            return {key: [(name, self.entries[name][2]) for name in names]
+                    for key, names in self.by_normalized.items()}
+
+    def conflicts(self):
+        """Return {normalized path: [(lock file name, lock data)]} for files locked by more than one user"""
+        return {key: locks for key, locks in self.normalized_paths().items()
+                if len({lock_data.get('user') for _, lock_data in locks}) > 1}
+
+    def expired(self, heartbeats, lease_seconds):
+        """Return [(lock file name, lock data or None)] for locks whose lease has run out
+
+        Only locks whose holder hasn't been seen for lease_seconds are looked
+        at. Those with a newer heartbeat are pushed back
+        with their new expiry; expired ones stay at the front until removed.
+        """
+        self.refresh()
+        now = time.time()
+        with self.lock:
+            expired = []
+            heap = self.lease_heap
+            while heap and heap[0][0] + lease_seconds <= now:
+                alive_at, name = heapq.heappop(heap)
+                if self.lease_keys.get(name) != alive_at:
+                    continue
+                mtime_ns, size, lock_data = self.entries[name]
+                if lock_data is not None:
+                    expires_at = lease_expiry(lock_data, heartbeats, lease_seconds, mtime_ns / 1e9)
+                    if expires_at > now:
+                        self._push_lease(name, expires_at - lease_seconds)
+                        continue
+                expired.append((name, lock_data))
+
+            for name, lock_data in expired:
+                heapq.heappush(heap, (self.lease_keys[name], name))
+            return expired
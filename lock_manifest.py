@@ -0,0 +1,115 @@
+import os
+import threading
+
+from heartbeat import heartbeat_key
+from local_state import load_state, save_state
+
+
+class LockManifest:
+    """The locks this user holds from this computer, kept in local state
+
+    It is updated on every acquire and release, so finding "my locks" reads
+    one small local file and stats those locks instead of listing the shared
+    lock folder. After an unclean shutdown it still names the locks that were
+    held, so the next start can check and release them. Updates are
+    serialized, so concurrent acquires and releases don't lose entries.
+    Entries teach lock_paths (a LockPathMapper) which file each lock name
+    stands for, so names can be turned back into paths.
+    """
+
+    def __init__(self, user, computer, lock_store, lock_paths=None):
+        self.user = user
+        self.computer = computer
+        self.lock_store = lock_store
+        self.lock_paths = lock_paths
+        self.state_name = f"manifest_{heartbeat_key(user, computer)}.json"
+        self.lock = threading.RLock()
+
+    def _listed(self):
+        """Return {lock file name: original path} from a listing of this computer's locks"""
+        self.lock_store.refresh(force=True)
+        return {name: lock_data.get('original_path')
+                for name, lock_data in self.lock_store.for_computer(self.computer)
+                if lock_data and lock_data.get('user') == self.user}
+
+    def locks(self):
+        """Return {lock file name: original path} for the locks we hold"""
+        with self.lock:
+            locks = load_state(self.state_name)
+            if not isinstance(locks, dict):
+                # First run (or a corrupted manifest): build it from one full
+                # listing of this computer's locks
+                locks = self._listed()
+                save_state(self.state_name, locks)
+            if self.lock_paths:
+                for name, original_path in locks.items():
+                    if original_path:
+                        self.lock_paths.remember(name, original_path)
+            return locks
+
+    def __len__(self):
+        return len(self.locks())
+
+    def add(self, lock_path, original_path):
+        """Record a lock we acquired (or found we already hold)"""
+        # Re-read first: the CLI and the tray may both update it
+        with self.lock:
+            locks = self.locks()
+            name = os.path.basename(lock_path)
+            if locks.get(name) != original_path:
+                locks[name] = original_path
+                save_state(self.state_name, locks)
+
+    def discard(self, lock_path):
+        """Record a lock we released"""
+        with self.lock:
+            locks = self.locks()
+            name = os.path.basename(lock_path)
+            if name in locks:
+                del locks[name]
+                save_state(self.state_name, locks)
+
+    def held(self):
+        """Return [(lock file name, lock data)] for the locks we still hold
+
+        Replays the manifest against the lock store, one lookup per entry.
+        Entries whose lock now belongs to someone else are dropped. A lock
+        that can't be read may only be unreachable for a moment, so its entry
+        is kept until reseed() confirms it is gone.
+        """
+        locks = self.locks()
+        held = []
+        taken = set()
+        for name in locks:
+            lock_data = self.lock_store.get(self.lock_store.lock_path(name))
+            if lock_data is None:
+                continue
+            if lock_data.get('user') == self.user and lock_data.get('computer') == self.computer:
+                held.append((name, lock_data))
+            else:
+                taken.add(name)
+
+        if taken:
+            with self.lock:
+                # Keep entries added while we were checking
+                current = self.locks()
+                for name in taken:
+                    current.pop(name, None)
+                save_state(self.state_name, current)
+        return held
+
+    def reseed(self):
+        """Rebuild the manifest from a listing of this computer's locks
+
+        Run with the monitor's periodic cross-check: it drops locks that are
+        gone and picks up ours that the manifest missed.
+        """
+        locks = self.locks()
+        listed = self._listed()
+        with self.lock:
+            # Keep entries added while we were listing
+            current = self.locks()
+            for name in current.keys() - locks.keys():
+                listed.setdefault(name, current[name])
+            if listed != current:
+                save_state(self.state_name, listed)
@@ -0,0 +1,100 @@
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Characters that can't appear in a lock file name; each becomes '_'
+UNSAFE_CHARS = '\\/:*?"<>|'
+SAFE_NAME_TABLE = str.maketrans({char: '_' for char in UNSAFE_CHARS})
+
+# Lock directory layouts. 'flat' keeps every lock directly in the lock
+# folder. 'project' and 'hash' put each lock in Locks/Shards/<shard>, keyed
+# by the lock name's first component (normally the top-level project
+# folder) or by a 2-hex-digit hash of the name. The shard is computed from
+# the lock name alone, so any client can find a lock in any layout.
+LOCK_LAYOUTS = ('flat', 'project', 'hash')
+SHARD_DIR = 'Shards'
+ROOT_SHARD = '_root'
+
+
+def shard_name(name, layout):
+    """Return the shard directory name for a lock file name"""
+    if layout == 'hash':
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()[:2]
+    prefix, sep, _ = name.partition('_')
+    if not sep or not prefix.strip('. '):
+        return ROOT_SHARD
+    return prefix
+
+
+def layout_path(lock_dir, name, layout):
+    """Return where a lock file lives in a layout"""
+    if layout not in ('project', 'hash'):
+        return os.path.join(lock_dir, name)
+    return os.path.join(lock_dir, SHARD_DIR, shard_name(name, layout), name)
+
+
+def candidate_paths(lock_dir, name, layout):
+    """Return every place a lock could be, the given layout's first"""
+    paths = [layout_path(lock_dir, name, layout)]
+    for other in LOCK_LAYOUTS:
+        path = layout_path(lock_dir, name, other)
+        if path not in paths:
+            paths.append(path)
+    return paths
+
+
+class LockPathMapper:
+    """Map CAD file paths to lock file names and back
+
+    A lock file is named after the file's path relative to CAD_ROOT_DIR with
+    path separators and other unsafe characters replaced by '_'. Names are
+    memoized in a bounded LRU cache, so the relpath and translate run once per
+    path rather than once per path per cycle.
+
+    The name alone can't be decoded ('_' also appears in real file names),
+    so the inverse mapping remembers the paths it has named recently, and
+    callers teach it names read from the lock manifest.
+    """
+
+    def __init__(self, cad_root, lock_dir, max_entries=8192, layout='flat'):
+        self.cad_root = cad_root
+        self.lock_dir = lock_dir
+        self.layout = layout
+        self.max_entries = max_entries
+        self.lock_name = functools.lru_cache(maxsize=max_entries)(self._lock_name)
+
+        # Lock file name -> original path, least recently used first
+        self.originals = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _lock_name(self, file_path):
+        """Return the lock file name for a CAD file"""
+        try:
+            # Get relative path from CAD root
+            rel_path = os.path.relpath(file_path, self.cad_root)
+        except ValueError:
+            # If file is not under CAD root (another drive), use the full path
+            rel_path = file_path
+
+        name = f"{rel_path.translate(SAFE_NAME_TABLE)}.lock"
+        self.remember(name, file_path)
+        return name
+
+    def lock_path(self, file_path):
+        """Return the full lock file path for a CAD file"""
+        return layout_path(self.lock_dir, self.lock_name(file_path), self.layout)
+
+    def remember(self, name, original_path):
+        """Record the original path behind a lock file name"""
+        with self.lock:
+            self.originals[name] = original_path
+            self.originals.move_to_end(name)
+            if len(self.originals) > 2 * self.max_entries:
+                self.originals.popitem(last=False)
+
+    def original_path(self, name):
+        """Return the CAD file path for a lock file name or path, or None if unknown"""
+        with self.lock:
+            return self.originals.get(os.path.basename(name))
@@ -0,0 +1,167 @@
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+# orjson is optional - it encodes/decodes lock records several times faster
+# than the stdlib json module, which is used otherwise.
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+# Version 1 is the original pretty-printed record with "%Y-%m-%d %H:%M:%S"
+# timestamps. Version 2 uses short keys and an epoch timestamp, so reading a
+# record needs no strptime. Readers accept both. Lock files are written as
+# version 1 unless LOCK_RECORD_VERSION=2, since older clients can't read
+# version 2 and would take those locks over.
+RECORD_VERSION = 2
+DEFAULT_FILE_RECORD_VERSION = 1
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Lock data field -> version 2 key
+V2_KEYS = {
+    'user': 'u',
+    'computer': 'c',
+    'original_path': 'p',
+    'locked_at': 't',
+    'auto_created': 'a',
+    'detection_method': 'm',
+    # Only in records written before leases ran from the last heartbeat
+    'expires_at': 'x',
+}
+V2_FIELDS = {key: field for field, key in V2_KEYS.items()}
+
+# Fields derived on read, never stored in version 2 records
+DERIVED_FIELDS = ('file', 'timestamp', 'last_seen', 'seen_at', 'lock_file', 'version')
+
+# Strings repeated across thousands of records share one object
+INTERNED_FIELDS = ('user', 'computer', 'detection_method')
+
+
+def make_lock_record(user, computer, file_path, auto_created, detection_method):
+    """Return the lock data for a new lock taken now"""
+    now = time.time()
+    lock_data = {
+        'user': user,
+        'computer': computer,
+        'timestamp': datetime.fromtimestamp(now).strftime(TIMESTAMP_FORMAT),
+        'locked_at': now,
+        'file': os.path.basename(file_path),
+        'original_path': file_path,
+        'auto_created': auto_created,
+        'detection_method': detection_method
+    }
+    return lock_data
+
+
+def loads(data):
+    """Parse a compact JSON value (record, journal line or snapshot)"""
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+
+def dumps(obj):
+    """Serialise a JSON value compactly to bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def pack_record(lock_data, version=RECORD_VERSION):
+    """Convert lock data to its stored form (a dict ready to serialise)"""
+    if version == 1:
+        record = {field: value for field, value in lock_data.items()
+                  if field not in ('locked_at', 'seen_at', 'version')}
+        if 'timestamp' not in record and 'locked_at' in lock_data:
+            record['timestamp'] = datetime.fromtimestamp(lock_data['locked_at']).strftime(TIMESTAMP_FORMAT)
+        return record
+
+    record = {'v': RECORD_VERSION}
+    for field, value in lock_data.items():
+        if field in V2_KEYS:
+            record[V2_KEYS[field]] = value
+        elif field not in DERIVED_FIELDS:
+            # Unknown fields are kept under their own name
+            record[field] = value
+
+    if 't' not in record:
+        record['t'] = _parse_timestamp(lock_data.get('timestamp'))
+    return record
+
+
+def unpack_record(record):
+    """Convert a stored record (version 1 or 2) to lock data, or None if it isn't one"""
+    if not isinstance(record, dict):
+        return None
+
+    if record.get('v') != 2:
+        # Version 1: parse the timestamp once here instead of on every use
+        lock_data = record
+        if 'locked_at' not in lock_data:
+            lock_data['locked_at'] = _parse_timestamp(lock_data.get('timestamp'))
+        if 'last_seen' in lock_data and 'seen_at' not in lock_data:
+            lock_data['seen_at'] = _parse_timestamp(lock_data['last_seen'])
+    else:
+        lock_data = {}
+        for key, value in record.items():
+            lock_data[V2_FIELDS.get(key, key)] = value
+        del lock_data['v']
+        original_path = lock_data.get('original_path') or ''
+        lock_data['file'] = os.path.basename(original_path)
+        locked_at = lock_data.get('locked_at') or 0
+        lock_data['timestamp'] = time.strftime(TIMESTAMP_FORMAT, time.localtime(locked_at))
+        lock_data['version'] = 2
+
+    for field in INTERNED_FIELDS:
+        value = lock_data.get(field)
+        if type(value) is str:
+            lock_data[field] = sys.intern(value)
+    return lock_data
+
+
+def _parse_timestamp(timestamp):
+    try:
+        return datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
+    except (TypeError, ValueError):
+        return 0
+
+
+def encode_record(lock_data, version=RECORD_VERSION):
+    """Serialise lock data for a lock file"""
+    if version == 1:
+        return json.dumps(pack_record(lock_data, 1), indent=2).encode('utf-8')
+    return dumps(pack_record(lock_data, version))
+
+
+def decode_record(data):
+    """Parse a lock file's bytes, returns lock data or None if it is corrupted"""
+    try:
+        return unpack_record(loads(data))
+    except (ValueError, TypeError):
+        return None
+
+
+def decode_records(chunks):
+    """Parse many serialised records, returns a list with None for corrupted ones"""
+    parse = orjson.loads if ORJSON_AVAILABLE else json.loads
+    unpack = unpack_record
+    records = []
+    append = records.append
+    for data in chunks:
+        try:
+            append(unpack(parse(data)))
+        except (ValueError, TypeError):
+            append(None)
+    return records
+
+
+def record_version_from_env():
+    """Return the record version to write, from LOCK_RECORD_VERSION"""
+    try:
+        version = int(os.getenv('LOCK_RECORD_VERSION', str(DEFAULT_FILE_RECORD_VERSION)))
+    except ValueError:
+        version = DEFAULT_FILE_RECORD_VERSION
+    return version if version in (1, RECORD_VERSION) else DEFAULT_FILE_RECORD_VERSION
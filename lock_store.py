@@ -0,0 +1,845 @@
+import json
+import os
+import threading
+import time
+
+from heartbeat import HeartbeatFiles, heartbeat_key, lease_expiry
+from local_state import get_state_dir
+from lock_index import LockIndex, normalize_lock_path
+from lock_paths import SHARD_DIR, candidate_paths, layout_path
+from lock_record import (DEFAULT_FILE_RECORD_VERSION, decode_record, dumps, encode_record, loads,
+                         pack_record, record_version_from_env, unpack_record)
+
+# Lock storage backends. All keep the LockIndex read interface (get, all,
+# for_user, for_normalized_path, normalized_paths, conflicts, get_mtime,
+# lock_path) and add acquire/write/remove plus beat/heartbeats, so CADLockManager, SimpleCADTray
+# and LockDashboard don't care where locks live. Locks are keyed by their
+# lock file path, which for the journal and SQLite backends is only a name.
+JOURNAL_SNAPSHOT_FILE = 'locks.snapshot.json'
+JOURNAL_FILE_PATTERN = 'locks.{generation}.journal'
+JOURNAL_COMPACT_LOCK_FILE = 'locks.compact.lock'
+# A compaction lock older than this was left by a writer that crashed
+COMPACT_LOCK_STALE_SECONDS = 120
+SQLITE_DB_FILE = 'locks.db'
+# Columns _row fills, named in inserts so databases created with the old
+# expires_at column keep working
+SQLITE_LOCK_COLUMNS = "name, original_path, normalized_path, user, computer, updated_at, data"
+
+
+class FileLockStore(LockIndex):
+    """One JSON .lock file per locked CAD file (the original layout)
+
+    New locks are created with O_CREAT|O_EXCL, so a conflicting acquire fails
+    on its single create instead of racing an exists/read/write sequence.
+    Updates are written to a temp file and renamed over the lock, so readers
+    never see a half-written lock. New locks go where LOCK_LAYOUT puts them;
+    existing ones are updated and removed where they are.
+    """
+
+    def __init__(self, lock_dir, max_age=2.0, record_version=DEFAULT_FILE_RECORD_VERSION, layout='flat'):
+        super().__init__(lock_dir, max_age, layout)
+        self.record_version = record_version
+        self.heartbeat_files = HeartbeatFiles(lock_dir)
+        self.created_dirs = set()
+
+    def beat(self, user, computer):
+        """Record that user's monitor on computer is alive"""
+        return self.heartbeat_files.beat(user, computer)
+
+    def heartbeats(self):
+        """Return {heartbeat key: last beat (seconds)}"""
+        return self.heartbeat_files.all()
+
+    def _ensure_dir(self, lock_path):
+        directory = os.path.dirname(lock_path)
+        if directory not in self.created_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self.created_dirs.add(directory)
+
+    def _held_elsewhere(self, lock_path):
+        """Return the path of a copy of this lock in another layout's place, or None"""
+        shard_root = os.path.join(self.lock_dir, SHARD_DIR)
+        others = [path for path in candidate_paths(self.lock_dir, os.path.basename(lock_path), self.layout)
+                  if path != lock_path]
+        if not os.path.isdir(shard_root):
+            # No sharded client has written yet: one stat instead of one per layout
+            others = [path for path in others if not path.startswith(shard_root + os.sep)]
+        for path in others:
+            if os.path.exists(path):
+                return path
+        return None
+
+    def acquire(self, lock_path, lock_data):
+        """Create a lock unless one exists, returns (acquired, current lock data)
+
+        Clients on different layouts create the lock in different places, so
+        after creating ours the other places are checked. If a copy exists
+        there (another client's, or one not migrated yet), ours is removed
+        and the acquire fails. Of two racing clients at least the later one
+        sees the other's copy, so both can't hold it.
+        """
+        content = encode_record(lock_data, self.record_version)
+        self._ensure_dir(lock_path)
+        for attempt in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+            except FileExistsError:
+                existing = self.get(lock_path, fresh=True)
+                if existing is not None:
+                    return False, existing
+                # Unreadable: another writer may be mid-create, look again
+                # before treating it as corrupted and taking it over
+                if attempt == 0:
+                    time.sleep(0.2)
+                    continue
+                self.write(lock_path, lock_data)
+                return True, lock_data
+
+            try:
+                os.write(fd, content)
+            finally:
+                os.close(fd)
+
+            other = self._held_elsewhere(lock_path)
+            if other:
+                os.remove(lock_path)
+                self.note_removed(lock_path)
+                self.legacy_locations = True
+                existing = self._read(other)
+                if existing is None:
+                    # Possibly mid-create, give it a moment
+                    time.sleep(0.2)
+                    existing = self._read(other)
+                return False, existing or {}
+
+            self.note_written(lock_path, lock_data)
+            return True, lock_data
+
+    def write(self, lock_path, lock_data):
+        """Create or overwrite a lock"""
+        lock_path = self.paths.get(os.path.basename(lock_path)) or lock_path
+        self._ensure_dir(lock_path)
+        temp_path = f"{lock_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(encode_record(lock_data, self.record_version))
+            os.replace(temp_path, lock_path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self.note_written(lock_path, lock_data)
+
+    def remove(self, lock_path):
+        """Delete a lock, raises OSError if it can't be removed"""
+        for path in self._locations(lock_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.note_removed(lock_path)
+            return
+        self.note_removed(lock_path)
+        raise FileNotFoundError(f"No lock file for {os.path.basename(lock_path)}")
+
+    def migrate(self):
+        """Move every lock to its place in the configured layout, returns the count moved"""
+        moved = 0
+        self.refresh(force=True)
+        for name in list(self.entries):
+            source = self.paths.get(name)
+            target = layout_path(self.lock_dir, name, self.layout)
+            if not source or source == target:
+                continue
+            try:
+                self._ensure_dir(target)
+                if os.path.exists(target):
+                    # Already recreated in the new layout, drop the old copy
+                    os.remove(source)
+                else:
+                    os.replace(source, target)
+                    moved += 1
+            except OSError as e:
+                print(f"Could not move {name}: {e}")
+        self.refresh(force=True)
+        return moved
+
+
+def _same_holder(lock_data, other):
+    """Return True if two lock records are held by the same user on the same computer"""
+    return (lock_data is not None and other is not None
+            and lock_data.get('user') == other.get('user')
+            and lock_data.get('computer') == other.get('computer'))
+
+
+class JournalLockStore(LockIndex):
+    """Append-only journal of acquire/renew/release records plus a snapshot
+
+    The full lock state is the snapshot with the current generation's journal
+    replayed on top. Readers keep their offset into the journal, so a refresh
+    is one stat plus a sequential read of the records appended since the last
+    one. Once the journal holds compact_records records the writer folds it
+    into a new snapshot and starts an empty journal for the next generation.
+    Only the writer that creates the compaction lock file compacts, the
+    others keep appending. Records appended to the old journal while
+    compacting are copied over, and a writer that finds the generation moved
+    on after its append writes the record again to the new journal, so a
+    record that missed the copy isn't lost. Replaying a record twice leaves
+    the same state.
+
+    Two clients' acquires can cross (both checked before seeing the other's
+    record), so replay keeps the first holder: a later acquire or renew of a
+    held lock by another user or computer is dropped, and the acquire that
+    appended it returns False.
+    """
+
+    def __init__(self, lock_dir, max_age=2.0, compact_records=500):
+        super().__init__(lock_dir, max_age)
+        self.compact_records = compact_records
+        self.snapshot_path = os.path.join(lock_dir, JOURNAL_SNAPSHOT_FILE)
+
+        # Position in the journal: snapshot identity, generation, byte offset
+        self.snapshot_stat = None
+        self.generation = 0
+        self.offset = 0
+        self.journal_records = 0
+
+        # Heartbeats change every cycle, so they stay out of the journal
+        self.heartbeat_files = HeartbeatFiles(lock_dir)
+
+    def beat(self, user, computer):
+        """Record that user's monitor on computer is alive"""
+        return self.heartbeat_files.beat(user, computer)
+
+    def heartbeats(self):
+        """Return {heartbeat key: last beat (seconds)}"""
+        return self.heartbeat_files.all()
+
+    def journal_path(self, generation=None):
+        """Return the journal file path for a generation"""
+        if generation is None:
+            generation = self.generation
+        return os.path.join(self.lock_dir, JOURNAL_FILE_PATTERN.format(generation=generation))
+
+    def _apply(self, record):
+        name = record.get('name')
+        if not name:
+            return
+        if record.get('op') == 'release':
+            self._drop(name)
+        else:
+            lock_data = unpack_record(record.get('data'))
+            if lock_data is None:
+                return
+            held = self.entries.get(name)
+            if held and not _same_holder(held[2], lock_data):
+                # Someone else's record came first, they keep the lock
+                return
+            self._put(name, int(record.get('ts', 0) * 1e9), 0, lock_data)
+
+    def _load_snapshot(self, st):
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = loads(f.read())
+        except (OSError, ValueError) as e:
+            print(f"Error reading lock snapshot: {e}")
+            return
+
+        self.entries = {}
+        self.by_path = {}
+        self.by_user = {}
+        self.by_computer = {}
+        self.by_normalized = {}
+        for name, (ts, record) in snapshot.get('locks', {}).items():
+            lock_data = unpack_record(record)
+            if lock_data is not None:
+                self._put(name, int(ts * 1e9), 0, lock_data)
+
+        self.snapshot_stat = (st.st_mtime_ns, st.st_size)
+        self.generation = snapshot.get('generation', 0)
+        self.offset = 0
+        self.journal_records = 0
+
+    def _read_journal(self):
+        """Replay complete records appended since the last read"""
+        try:
+            with open(self.journal_path(), 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"Error reading lock journal: {e}")
+            return
+
+        # A writer may be mid-append, only consume up to the last newline
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                self._apply(loads(line))
+            except (ValueError, TypeError, AttributeError):
+                continue
+            self.journal_records += 1
+        self.offset += end
+
+    def refresh(self, force=False):
+        """Pick up a new snapshot and replay new journal records"""
+        with self.lock:
+            if not force and time.time() - self.last_refresh < self.max_age:
+                return
+
+            try:
+                st = os.stat(self.snapshot_path)
+                if (st.st_mtime_ns, st.st_size) != self.snapshot_stat:
+                    self._load_snapshot(st)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error reading lock directory: {e}")
+                return
+
+            self._read_journal()
+            self.last_refresh = time.time()
+
+    def get(self, lock_path):
+        """Return the lock data for a lock, or None"""
+        self.refresh()
+        with self.lock:
+            entry = self.entries.get(os.path.basename(lock_path))
+            return entry[2] if entry else None
+
+    def _append(self, op, lock_path, lock_data=None):
+        record = {
+            'op': op,
+            'name': os.path.basename(lock_path),
+            'ts': time.time()
+        }
+        if lock_data is not None:
+            record['data'] = pack_record(lock_data)
+        line = dumps(record) + b'\n'
+
+        with self.lock:
+            # Catch up first so we append to the current generation's journal
+            self.refresh(force=True)
+            while True:
+                generation = self.generation
+                with open(self.journal_path(generation), 'ab') as f:
+                    f.write(line)
+                self.refresh(force=True)
+                if self.generation == generation:
+                    break
+                # A compaction swapped in its snapshot around our append and
+                # may have copied the old journal before our record reached it
+
+            if self.journal_records >= self.compact_records:
+                self.compact()
+
+    def write(self, lock_path, lock_data):
+        """Acquire a lock, or renew it if it already exists"""
+        op = 'renew' if self.get(lock_path) is not None else 'acquire'
+        self._append(op, lock_path, lock_data)
+
+    def acquire(self, lock_path, lock_data):
+        """Create a lock unless one exists, returns (acquired, current lock data)"""
+        with self.lock:
+            self.refresh(force=True)
+            existing = self.get(lock_path)
+            if existing is not None:
+                return False, existing
+            self._append('acquire', lock_path, lock_data)
+
+            # Another client's acquire may have been appended before ours
+            held = self.get(lock_path)
+            if not _same_holder(held, lock_data):
+                return False, held or {}
+            return True, lock_data
+
+    def remove(self, lock_path):
+        """Release a lock, raises FileNotFoundError if it isn't held"""
+        if self.get(lock_path) is None:
+            raise FileNotFoundError(f"No lock named {os.path.basename(lock_path)}")
+        self._append('release', lock_path)
+
+    def compact(self):
+        """Fold the journal into a new snapshot and start the next generation
+
+        Returns False without compacting if another writer is compacting.
+        """
+        lock_path = os.path.join(self.lock_dir, JOURNAL_COMPACT_LOCK_FILE)
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock_path).st_mtime > COMPACT_LOCK_STALE_SECONDS:
+                    os.remove(lock_path)
+            except OSError:
+                pass
+            return False
+        except OSError as e:
+            print(f"Could not compact lock journal: {e}")
+            return False
+
+        try:
+            return self._compact()
+        finally:
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+
+    def _compact(self):
+        with self.lock:
+            self.refresh(force=True)
+            old_generation = self.generation
+            new_generation = old_generation + 1
+
+            snapshot = {
+                'generation': new_generation,
+                'locks': {name: [entry[0] / 1e9, pack_record(entry[2])] for name, entry in self.entries.items()}
+            }
+            temp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            try:
+                open(self.journal_path(new_generation), 'a').close()
+                with open(temp_path, 'wb') as f:
+                    f.write(dumps(snapshot))
+                os.replace(temp_path, self.snapshot_path)
+            except OSError as e:
+                print(f"Could not compact lock journal: {e}")
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                return False
+
+            # Carry over records other writers appended while we compacted
+            try:
+                with open(self.journal_path(old_generation), 'rb') as f:
+                    f.seek(self.offset)
+                    tail = f.read()
+                tail = tail[:tail.rfind(b'\n') + 1]
+                if tail:
+                    with open(self.journal_path(new_generation), 'ab') as f:
+                        f.write(tail)
+            except OSError:
+                pass
+
+            # Keep the previous journal one generation longer for slow writers
+            try:
+                os.remove(self.journal_path(old_generation - 1))
+            except OSError:
+                pass
+
+            self.snapshot_stat = None
+            self.refresh(force=True)
+            return True
+
+
+class SqliteLockStore:
+    """Locks as rows in a SQLite database in WAL mode
+
+    Lookups by normalized path, user and expiry are indexed queries, and
+    acquire is a conditional insert inside a transaction. WAL needs every
+    process to be on the same machine, so this is meant for single-host
+    installs and local benchmarking rather than a shared drive. The database
+    defaults to the local state folder, and a path inside the lock folder
+    gets a warning: a synced or network drive can corrupt it.
+    """
+
+    def __init__(self, lock_dir, db_path=None):
+        import sqlite3
+
+        self.lock_dir = lock_dir
+        self.db_path = db_path or os.path.join(get_state_dir(), SQLITE_DB_FILE)
+        self.lock = threading.RLock()
+
+        lock_root = os.path.normcase(os.path.abspath(lock_dir))
+        if os.path.normcase(os.path.abspath(self.db_path)).startswith(lock_root + os.sep):
+            print(f"Warning: SQLite lock database {self.db_path} is in the shared lock folder. "
+                  f"SQLite is only safe on a local disk with every client on this computer.")
+
+        self.conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS locks (
+                name TEXT PRIMARY KEY,
+                original_path TEXT,
+                normalized_path TEXT,
+                user TEXT,
+                computer TEXT,
+                updated_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS locks_normalized_path ON locks (normalized_path);
+            CREATE INDEX IF NOT EXISTS locks_user ON locks (user);
+            DROP INDEX IF EXISTS locks_expires_at;
+            CREATE INDEX IF NOT EXISTS locks_updated_at ON locks (updated_at);
+            CREATE TABLE IF NOT EXISTS heartbeats (
+                key TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self.heartbeat_interval = 10
+        self.last_beats = {}
+
+    def _row(self, lock_path, lock_data):
+        original_path = lock_data.get('original_path') or None
+        return (os.path.basename(lock_path), original_path,
+                normalize_lock_path(original_path) if original_path else None,
+                lock_data.get('user'), lock_data.get('computer'),
+                time.time(), encode_record(lock_data).decode('utf-8'))
+
+    def _select(self, where='', params=()):
+        with self.lock:
+            rows = self.conn.execute(f"SELECT name, data FROM locks {where}", params).fetchall()
+        return [(name, decode_record(data)) for name, data in rows]
+
+    def refresh(self, force=False):
+        """Nothing to refresh, every read is a query"""
+
+    def lock_path(self, name):
+        """Return the lock path for a lock name"""
+        return os.path.join(self.lock_dir, name)
+
+    def get(self, lock_path):
+        """Return the lock data for a lock, or None"""
+        locks = self._select("WHERE name = ?", (os.path.basename(lock_path),))
+        return locks[0][1] if locks else None
+
+    def get_mtime(self, name):
+        """Return when a lock was last written (seconds), or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT updated_at FROM locks WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def all(self):
+        """Return [(lock name, lock data)] for every lock"""
+        return self._select()
+
+    def for_path(self, file_path):
+        """Return locks whose original_path is exactly file_path"""
+        return [(name, lock_data) for name, lock_data in self.for_normalized_path(file_path)
+                if lock_data.get('original_path') == file_path]
+
+    def for_normalized_path(self, file_path):
+        """Return locks on file_path, however the path was spelled"""
+        return self._select("WHERE normalized_path = ?", (normalize_lock_path(file_path),))
+
+    def for_user(self, user):
+        """Return locks held by a user"""
+        return self._select("WHERE user = ?", (user,))
+
+    def for_computer(self, computer):
+        """Return locks held from a computer"""
+        return self._select("WHERE computer = ?", (computer,))
+
+    def normalized_paths(self):
+        """Return {normalized path: [(lock name, lock data)]} for all locks"""
+        grouped = {}
+        for name, lock_data in self._select("WHERE normalized_path IS NOT NULL"):
+            grouped.setdefault(normalize_lock_path(lock_data['original_path']), []).append((name, lock_data))
+        return grouped
+
+    def conflicts(self):
+        """Return {normalized path: [(lock name, lock data)]} for files locked by more than one user"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT normalized_path, name, data FROM locks WHERE normalized_path IN ("
+                " SELECT normalized_path FROM locks WHERE normalized_path IS NOT NULL"
+                " GROUP BY normalized_path HAVING COUNT(DISTINCT user) > 1)").fetchall()
+        grouped = {}
+        for normalized_path, name, data in rows:
+            grouped.setdefault(normalized_path, []).append((name, decode_record(data)))
+        return grouped
+
+    def expired(self, heartbeats, lease_seconds):
+        """Return [(lock name, lock data)] for locks whose lease has run out"""
+        now = time.time()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name, updated_at, data FROM locks WHERE updated_at <= ?",
+                (now - lease_seconds,)).fetchall()
+        expired = []
+        for name, updated_at, data in rows:
+            lock_data = decode_record(data)
+            if lock_data is None or lease_expiry(lock_data, heartbeats, lease_seconds, updated_at) <= now:
+                expired.append((name, lock_data))
+        return expired
+
+    def acquire(self, lock_path, lock_data):
+        """Create a lock unless one exists, returns (acquired, current lock data)"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.conn.execute(
+                    f"INSERT OR IGNORE INTO locks ({SQLITE_LOCK_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    self._row(lock_path, lock_data))
+                if cursor.rowcount == 1:
+                    self.conn.execute("COMMIT")
+                    return True, lock_data
+                row = self.conn.execute("SELECT data FROM locks WHERE name = ?",
+                                        (os.path.basename(lock_path),)).fetchone()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return False, decode_record(row[0])
+
+    def write(self, lock_path, lock_data):
+        """Create or overwrite a lock"""
+        with self.lock:
+            self.conn.execute(f"INSERT OR REPLACE INTO locks ({SQLITE_LOCK_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              self._row(lock_path, lock_data))
+
+    def remove(self, lock_path):
+        """Delete a lock, raises FileNotFoundError if it isn't held"""
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM locks WHERE name = ?", (os.path.basename(lock_path),))
+        if cursor.rowcount == 0:
+            raise FileNotFoundError(f"No lock named {os.path.basename(lock_path)}")
+
+    def beat(self, user, computer):
+        """Record that user's monitor on computer is alive"""
+        now = time.time()
+        key = heartbeat_key(user, computer)
+        if now - self.last_beats.get(key, 0) < self.heartbeat_interval:
+            return False
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO heartbeats VALUES (?, ?)", (key, now))
+        self.last_beats[key] = now
+        return True
+
+    def heartbeats(self):
+        """Return {heartbeat key: last beat (seconds)}"""
+        with self.lock:
+            return dict(self.conn.execute("SELECT key, updated_at FROM heartbeats").fetchall())
+
+
+class RemoteLockStore:
+    """Locks held by the lock server in the dashboard process, over HTTP/JSON
+
+    The server serialises acquires, so two computers can't both take the same
+    lock, and a lock is visible to everyone after one LAN round trip instead
+    of a Drive sync. While the server is unreachable every call goes to the
+    fallback store (the lock folder), and the server is retried every
+    retry_interval seconds.
+    """
+
+    def __init__(self, server_url, fallback, timeout=2.0, retry_interval=30, user=None, computer=None):
+        self.server_url = server_url.rstrip('/')
+        self.fallback = fallback
+        self.lock_dir = fallback.lock_dir
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.offline_until = 0
+
+        # Sent with renew and release, the server only lets a lock's holder change it
+        self.user = user
+        self.computer = computer
+
+        # Lock name -> last write time (seconds) from the last listing
+        self.mtimes = {}
+        self.heartbeat_interval = 10
+        self.last_beat = 0
+
+    def _call(self, method, route, payload=None, params=None):
+        """Send a request to the server, returns the decoded JSON reply
+
+        Raises KeyError for a 404, PermissionError if the server refuses
+        (403/409) and ConnectionError if the server can't be reached.
+        """
+        import urllib.error
+        import urllib.parse
+        import urllib.request
+
+        if time.time() < self.offline_until:
+            raise ConnectionError("lock server offline")
+
+        url = f"{self.server_url}/api/store/{route}"
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(url, data=body, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                reply = json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise KeyError(route)
+            if e.code in (403, 409):
+                raise PermissionError(f"lock server refused {route}: lock held by someone else")
+            if not self.offline_until:
+                print(f"Lock server error {e.code}, using lock folder")
+            self.offline_until = time.time() + self.retry_interval
+            raise ConnectionError(f"lock server error {e.code}")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            if not self.offline_until:
+                print(f"Lock server unreachable ({e}), using lock folder")
+            self.offline_until = time.time() + self.retry_interval
+            raise ConnectionError(str(e))
+
+        if self.offline_until:
+            print("Lock server reachable again")
+            self.offline_until = 0
+        return reply
+
+    def _locks(self, reply):
+        locks = []
+        for name, lock_data, mtime in reply.get('locks', []):
+            self.mtimes[name] = mtime
+            locks.append((name, lock_data))
+        return locks
+
+    def _query(self, **params):
+        try:
+            return self._locks(self._call('GET', 'locks', params=params))
+        except ConnectionError:
+            return None
+
+    def refresh(self, force=False):
+        """Nothing to refresh, every read asks the server"""
+
+    def lock_path(self, name):
+        """Return the lock path for a lock name"""
+        return os.path.join(self.lock_dir, name)
+
+    def get(self, lock_path):
+        """Return the lock data for a lock, or None"""
+        try:
+            return self._call('GET', 'lock', params={'name': os.path.basename(lock_path)}).get('lock')
+        except KeyError:
+            return None
+        except ConnectionError:
+            return self.fallback.get(lock_path)
+
+    def get_mtime(self, name):
+        """Return when a lock was last written (seconds), or None"""
+        if name in self.mtimes:
+            return self.mtimes[name]
+        return self.fallback.get_mtime(name)
+
+    def all(self):
+        """Return [(lock name, lock data)] for every lock"""
+        locks = self._query()
+        return self.fallback.all() if locks is None else locks
+
+    def for_path(self, file_path):
+        """Return locks whose original_path is exactly file_path"""
+        return [(name, lock_data) for name, lock_data in self.for_normalized_path(file_path)
+                if lock_data.get('original_path') == file_path]
+
+    def for_normalized_path(self, file_path):
+        """Return locks on file_path, however the path was spelled"""
+        locks = self._query(normalized_path=file_path)
+        return self.fallback.for_normalized_path(file_path) if locks is None else locks
+
+    def for_user(self, user):
+        """Return locks held by a user"""
+        locks = self._query(user=user)
+        return self.fallback.for_user(user) if locks is None else locks
+
+    def for_computer(self, computer):
+        """Return locks held from a computer"""
+        locks = self._query(computer=computer)
+        return self.fallback.for_computer(computer) if locks is None else locks
+
+    def normalized_paths(self):
+        """Return {normalized path: [(lock name, lock data)]} for all locks"""
+        grouped = {}
+        for name, lock_data in self.all():
+            if lock_data and lock_data.get('original_path'):
+                grouped.setdefault(normalize_lock_path(lock_data['original_path']), []).append((name, lock_data))
+        return grouped
+
+    def conflicts(self):
+        """Return {normalized path: [(lock name, lock data)]} for files locked by more than one user"""
+        locks = self._query(conflicts=1)
+        if locks is None:
+            return self.fallback.conflicts()
+        grouped = {}
+        for name, lock_data in locks:
+            grouped.setdefault(normalize_lock_path(lock_data['original_path']), []).append((name, lock_data))
+        return grouped
+
+    def expired(self, heartbeats, lease_seconds):
+        """Return [(lock name, lock data)] for locks whose lease has run out
+
+        The server judges leases by its own heartbeats, which every client sends.
+        """
+        locks = self._query(expired=lease_seconds)
+        return self.fallback.expired(heartbeats, lease_seconds) if locks is None else locks
+
+    def acquire(self, lock_path, lock_data):
+        """Create a lock unless one exists, returns (acquired, current lock data)"""
+        try:
+            reply = self._call('POST', 'acquire', {'name': os.path.basename(lock_path), 'lock': lock_data})
+            return reply['acquired'], reply['lock']
+        except ConnectionError:
+            return self.fallback.acquire(lock_path, lock_data)
+
+    def write(self, lock_path, lock_data):
+        """Create or overwrite a lock"""
+        try:
+            self._call('POST', 'renew', {'name': os.path.basename(lock_path), 'lock': lock_data,
+                                         'user': self.user, 'computer': self.computer})
+        except ConnectionError:
+            self.fallback.write(lock_path, lock_data)
+
+    def remove(self, lock_path):
+        """Release a lock, raises FileNotFoundError if it isn't held
+
+        Raises PermissionError if the server says someone else holds it.
+        """
+        try:
+            self._call('POST', 'release', {'name': os.path.basename(lock_path),
+                                           'user': self.user, 'computer': self.computer})
+        except KeyError:
+            raise FileNotFoundError(f"No lock named {os.path.basename(lock_path)}")
+        except ConnectionError:
+            self.fallback.remove(lock_path)
+
+    def beat(self, user, computer):
+        """Record that user's monitor on computer is alive"""
+        if time.time() - self.last_beat < self.heartbeat_interval:
+            return False
+        try:
+            self._call('POST', 'heartbeat', {'user': user, 'computer': computer})
+            self.last_beat = time.time()
+            return True
+        except ConnectionError:
+            return self.fallback.beat(user, computer)
+
+    def heartbeats(self):
+        """Return {heartbeat key: last beat (seconds)}"""
+        try:
+            return self._call('GET', 'heartbeats')['heartbeats']
+        except ConnectionError:
+            return self.fallback.heartbeats()
+
+
+def open_lock_store(lock_dir, backend='file', layout='flat', user=None, computer=None):
+    """Return the lock store for LOCK_BACKEND and LOCK_LAYOUT settings
+
+    user and computer identify this client to the lock server.
+    """
+    if backend == 'server':
+        server_url = os.getenv('LOCK_SERVER_URL')
+        fallback = FileLockStore(lock_dir, record_version=record_version_from_env(), layout=layout)
+        if server_url:
+            return RemoteLockStore(server_url, fallback,
+                                   timeout=float(os.getenv('LOCK_SERVER_TIMEOUT', '2')),
+                                   user=user, computer=computer)
+        print("LOCK_BACKEND=server needs LOCK_SERVER_URL, using file")
+        return fallback
+    if backend == 'sqlite':
+        return SqliteLockStore(lock_dir, os.getenv('LOCK_DB_PATH') or None)
+    if backend == 'journal':
+        compact_records = int(os.getenv('JOURNAL_COMPACT_RECORDS', '500'))
+        return JournalLockStore(lock_dir, compact_records=compact_records)
+    if backend != 'file':
+        print(f"Unknown LOCK_BACKEND '{backend}', using file")
+    return FileLockStore(lock_dir, record_version=record_version_from_env(), layout=layout)
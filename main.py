@@ -1,15 +1,20 @@
 import os
-import json
 import sys
-import subprocess
-import psutil
 import threading
 import time
-from datetime import datetime, timedelta
-from pathlib import Path
+from datetime import datetime
+
+from local_state import load_recent_opens, record_recent_open
+from lock_manifest import LockManifest
+from lock_paths import LockPathMapper
+from lock_record import make_lock_record
+from lock_store import open_lock_store
+
+# Monitor modules (psutil, watchdog, asyncio, the scanner) are imported
+# when monitoring starts, so one-shot commands start quickly
 
 class CADLockManager:
-    def __init__(self):
+    def __init__(self, validate=True):
         self.user = os.getenv('USER_OVERRIDE') or os.getenv('USERNAME') or os.getenv('USER')
         self.computer = os.getenv('COMPUTER_OVERRIDE') or os.getenv('COMPUTERNAME') or os.getenv('HOSTNAME')
         
@@ -19,18 +24,101 @@ class CADLockManager:
         self.solidworks_path = os.getenv('SOLIDWORKS_PATH', r"C:\Program Files\SOLIDWORKS Corp\SOLIDWORKS\SLDWORKS.exe")
         
         # Get settings from environment variables
-        self.cleanup_max_hours = int(os.getenv('CLEANUP_MAX_HOURS', '24'))
-        self.monitor_interval = int(os.getenv('MONITOR_INTERVAL', '10'))
+        # Locks are leases of CLEANUP_MAX_HOURS, extended by the holder's heartbeat
+        self.cleanup_max_hours = float(os.getenv('CLEANUP_MAX_HOURS', '24'))
+        self.monitor_interval = float(os.getenv('MONITOR_INTERVAL', '10'))
+        self.full_rescan_interval = int(os.getenv('FULL_RESCAN_INTERVAL', '600'))
+        self.scan_workers = int(os.getenv('SCAN_WORKERS', '8'))
+        self.hot_scan_interval = int(os.getenv('HOT_SCAN_INTERVAL', '0'))
+        self.cold_scan_interval = int(os.getenv('COLD_SCAN_INTERVAL', '0'))
+        self.scan_budget = float(os.getenv('SCAN_BUDGET_SECONDS', '2'))
+        
+        # 'watch' reacts to temp file events and only polls as a fallback,
+        # 'poll' scans the CAD tree every cycle
+        self.monitor_mode = os.getenv('MONITOR_MODE', 'watch').lower()
+        self.watch_rescan_interval = int(os.getenv('WATCH_RESCAN_INTERVAL', '300'))
+        self.process_rescan_interval = int(os.getenv('PROCESS_RESCAN_INTERVAL', '60'))
+        
+        # Scanner, watcher, process tracker and schedulers, created by
+        # _init_monitor when monitoring first starts
+        self.scanner = None
+        
+        # 'temp_file' walks the tree for ~$ files, 'process_handles' reads the
+        # files SolidWorks holds open and uses the walk only as a cross-check
+        self.detection_method = os.getenv('DETECTION_METHOD', 'temp_file').lower()
+        self.temp_only_files = set()
+        
+        # 'file' keeps one .lock file per lock (parsed once, re-read only when
+        # its mtime/size changes), 'journal' an append-only log plus snapshot
+        self.lock_backend = os.getenv('LOCK_BACKEND', 'file').lower()
+        # 'flat' keeps every lock in the lock folder, 'project'/'hash' shard them
+        self.lock_layout = os.getenv('LOCK_LAYOUT', 'flat').lower()
+        self.lock_store = open_lock_store(self.lock_dir, self.lock_backend, self.lock_layout,
+                                          self.user, self.computer)
+        self.lock_paths = LockPathMapper(self.cad_root, self.lock_dir, layout=self.lock_layout)
+        
+        # Locks held from this computer, so "my locks" needs no folder listing
+        self.manifest = LockManifest(self.user, self.computer, self.lock_store, self.lock_paths)
         
-        # Auto-monitoring
+        # Open files and the ones we hold locks for as of the last sync, so a
+        # sync only acquires or releases locks for files that changed
+        self.synced_files = {}
+        self.synced_locks = set()
+        
+        # Slow work runs on its own cadence on a worker thread, so it never
+        # delays locking a newly opened file
+        self.cleanup_interval = int(os.getenv('CLEANUP_INTERVAL', '300'))
+        self.live_lock_folders = set()
+        
+        # Auto-monitoring. The 'asyncio' engine overlaps each cycle's scans,
+        # lock reads/writes and process checks on MONITOR_IO_WORKERS threads
+        self.monitor_engine = os.getenv('MONITOR_ENGINE', 'thread').lower()
+        self.monitor_io_workers = int(os.getenv('MONITOR_IO_WORKERS', '8'))
         self.auto_monitor_running = False
         self.monitor_thread = None
+        self.async_monitor = None
         
         # Create lock directory if it doesn't exist
         os.makedirs(self.lock_dir, exist_ok=True)
         
-        # Validate critical paths
-        self._validate_paths()
+        # Validate critical paths (skipped by quick commands like check)
+        if validate:
+            self._validate_paths()
+    
+    def _init_monitor(self):
+        """Create the scanner, watcher, process tracker and schedulers"""
+        from scanner import IncrementalScanner, rules_from_env
+        from scheduler import MonitorScheduler, TaskScheduler
+        from sw_process import SolidWorksTracker
+        from watcher import TempFileWatcher
+        
+        # Temp-file scanner keeps a directory cache between monitor cycles,
+        # lists sibling directories concurrently on SCAN_WORKERS threads and
+        # checks hot folders more often than the cold rest of the tree. Walks
+        # that overrun SCAN_BUDGET_SECONDS resume from a saved cursor, and
+        # excluded folders (including the lock directory) are never entered.
+        self.scan_rules = rules_from_env(self.cad_root, self.lock_dir)
+        self.scanner = IncrementalScanner(self.cad_root, self.full_rescan_interval, self.scan_workers,
+                                          hot_scan_interval=self.hot_scan_interval,
+                                          cold_scan_interval=self.cold_scan_interval,
+                                          cursor_name='scan_cursor_main.json',
+                                          rules=self.scan_rules)
+        self.watcher = TempFileWatcher(self.cad_root, rules=self.scan_rules)
+        
+        # SLDWORKS processes are checked by PID once found; their exit wakes
+        # the monitor loop so our locks are released right away
+        self.solidworks = SolidWorksTracker(self.process_rescan_interval, on_exit=self.watcher.wake)
+        
+        # Cycle interval: short after activity, backing off to MONITOR_INTERVAL
+        # while SolidWorks is quiet and MONITOR_IDLE_INTERVAL while it's closed
+        self.scheduler = MonitorScheduler(self.computer,
+                                          min_interval=float(os.getenv('MONITOR_MIN_INTERVAL', '2')),
+                                          active_interval=self.monitor_interval,
+                                          idle_interval=float(os.getenv('MONITOR_IDLE_INTERVAL', '60')),
+                                          jitter=float(os.getenv('MONITOR_JITTER', '0.2')))
+        
+        self.tasks = TaskScheduler()
+        self.tasks.add('cleanup', self.cleanup_expired_locks, self.cleanup_interval, background=True)
     
     def _validate_paths(self):
         """Validate that required paths exist and are accessible"""
@@ -47,93 +135,119 @@ class CADLockManager:
     
     def is_solidworks_running(self):
         """Check if SolidWorks is running"""
-        for proc in psutil.process_iter(['name']):
-            try:
-                if proc.info['name'] and 'sldworks' in proc.info['name'].lower():
-                    return True
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
-        return False
+        return self.solidworks.running()
     
     def find_open_solidworks_files(self):
         """Find open SolidWorks files by detecting temp files"""
         open_files = set()
         
         try:
-            # Walk through CAD directory looking for temp files
-            for root, dirs, files in os.walk(self.cad_root):
-                for file in files:
-                    # SolidWorks creates temp files with ~$ prefix
-                    if file.startswith('~$') and any(file.lower().endswith(ext) for ext in ['.sldprt', '.sldasm', '.slddrw']):
-                        # The temp file indicates the original file is open
-                        original_file = file[2:]  # Remove ~$ prefix
-                        original_path = os.path.join(root, original_file)
-                        
-                        # Check if the original file exists
-                        if os.path.exists(original_path):
-                            open_files.add(original_path)
-                        
+            # Folders of files recently opened via 'main.py open' are hot
+            for recent_path, opened_at in load_recent_opens().items():
+                self.scanner.mark_hot(os.path.dirname(recent_path), opened_at)
+            
+            # SolidWorks creates temp files with ~$ prefix next to open documents.
+            # The scanner only re-lists directories that changed since last cycle
+            # and yields matches as soon as their directory has been listed.
+            for original_path in self.scanner.iter_open_files(budget=self.scan_budget):
+                open_files.add(original_path)
+            
+            if self.scanner.last_scan_was_full and not self.scanner.scan_in_progress():
+                staleness = self.scanner.staleness()
+                print(f"🔎 Full scan: {staleness['hot_dirs']} hot folders, {staleness['cold_subtrees']} cold subtrees, "
+                      f"{self.scanner.dirs_pruned} folders pruned by exclusions ({self.scan_rules.describe()})")
         except Exception as e:
             print(f"Error scanning for temp files: {e}")
         
         return open_files
     
-    def create_lock(self, file_path, auto_created=False):
-        lock_path = self.get_lock_path(file_path)
+    def find_open_files_from_process(self):
+        """Find open SolidWorks files from the file handles held by SLDWORKS"""
+        open_files = set()
         
-        if os.path.exists(lock_path):
-            try:
-                with open(lock_path, 'r') as f:
-                    lock_data = json.load(f)
-                    
-                # If it's our lock, update the timestamp
-                if lock_data.get('user') == self.user:
-                    lock_data['last_seen'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    if auto_created:
-                        lock_data['auto_created'] = True
-                    with open(lock_path, 'w') as f:
-                        json.dump(lock_data, f, indent=2)
-                    return True
-                else:
-                    print(f"File locked by {lock_data['user']} on {lock_data['computer']} since {lock_data['timestamp']}")
-                    return False
-            except:
-                pass
+        from sw_process import find_open_documents
         
-        lock_data = {
-            'user': self.user,
-            'computer': self.computer,
-            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'last_seen': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'file': os.path.basename(file_path),
-            'original_path': file_path,
-            'lock_file': lock_path,
-            'auto_created': auto_created,
-            'detection_method': 'temp_file' if auto_created else 'manual'
-        }
+        try:
+            open_files = find_open_documents(self.solidworks.processes(), self.cad_root)
+        except Exception as e:
+            print(f"Error reading SolidWorks file handles: {e}")
+        
+        return open_files
+    
+    def detect_open_files(self, cross_check=False):
+        """Return {file_path: detection_method} for currently open files"""
+        if self.detection_method != 'process_handles':
+            return {path: 'temp_file' for path in self.find_open_solidworks_files()}
+        
+        detected = {path: 'process_handles' for path in self.find_open_files_from_process()}
+        
+        if cross_check:
+            # Temp files catch documents whose handles we can't see
+            self.temp_only_files = self.find_open_solidworks_files() - detected.keys()
+            if self.temp_only_files:
+                print(f"⚠️ Cross-check found {len(self.temp_only_files)} open files without a SolidWorks handle")
+        
+        # Keep files found only by the cross-check while their temp file exists
+        for path in list(self.temp_only_files):
+            temp_path = os.path.join(os.path.dirname(path), '~$' + os.path.basename(path))
+            if path in detected or not os.path.exists(temp_path):
+                self.temp_only_files.discard(path)
+            else:
+                detected[path] = 'temp_file'
+        
+        return detected
+    
+    def create_lock(self, file_path, auto_created=False, detection_method=None):
+        lock_path = self.get_lock_path(file_path)
+        
+        lock_data = make_lock_record(self.user, self.computer, file_path, auto_created,
+                                     detection_method or ('temp_file' if auto_created else 'manual'))
         
         try:
-            with open(lock_path, 'w') as f:
-                json.dump(lock_data, f, indent=2)
+            # Create the lock only if nobody holds it
+            acquired, existing = self.lock_store.acquire(lock_path, lock_data)
+        except Exception as e:
+            print(f"Failed to create lock: {e}")
+            return False
+        
+        if acquired:
+            self.manifest.add(lock_path, file_path)
             if auto_created:
                 print(f"🔒 Auto-locked: {os.path.basename(file_path)}")
             else:
                 print(f"Lock created for {os.path.basename(file_path)}")
             return True
+        
+        try:
+            # Already our lock. Liveness is tracked by the heartbeat, so the
+            # lock is only rewritten if a manual lock becomes auto-managed.
+            if existing.get('user') == self.user:
+                if auto_created and not existing.get('auto_created'):
+                    existing = dict(existing, auto_created=True)
+                    self.lock_store.write(lock_path, existing)
+                if existing.get('computer') == self.computer:
+                    self.manifest.add(lock_path, file_path)
+                return True
+            else:
+                print(f"File locked by {existing.get('user')} on {existing.get('computer')} since {existing.get('timestamp')}")
+                return False
         except Exception as e:
-            print(f"Failed to create lock: {e}")
+            print(f"Failed to update lock: {e}")
             return False
     
-    def remove_lock(self, file_path):
+    def remove_lock(self, file_path, auto_only=False):
         lock_path = self.get_lock_path(file_path)
+        lock_data = self.lock_store.get(lock_path)
         
-        if os.path.exists(lock_path):
+        if lock_data is not None:
             try:
-                with open(lock_path, 'r') as f:
-                    lock_data = json.load(f)
+                if auto_only and not (lock_data.get('user') == self.user and lock_data.get('auto_created')):
+                    # Leave manual locks and other users' locks alone
+                    return
                 
                 if lock_data.get('user') == self.user or lock_data.get('computer') == self.computer:
-                    os.remove(lock_path)
+                    self.lock_store.remove(lock_path)
+                    self.manifest.discard(lock_path)
                     if lock_data.get('auto_created'):
                         print(f"🔓 Auto-unlocked: {os.path.basename(file_path)}")
                     else:
@@ -142,20 +256,19 @@ class CADLockManager:
                     print(f"Cannot remove lock - owned by {lock_data.get('user')}")
             except Exception as e:
                 print(f"Error removing lock: {e}")
-        else:
+        elif not auto_only:
             print(f"No lock found for: {os.path.basename(file_path)}")
     
     def check_lock(self, file_path):
         lock_path = self.get_lock_path(file_path)
+        lock_info = self.lock_store.get(lock_path)
         
-        if os.path.exists(lock_path):
-            with open(lock_path, 'r') as f:
-                lock_info = json.load(f)
+        if lock_info is not None:
             print(f"Lock Status for: {os.path.basename(file_path)}")
             print(f"Locked by: {lock_info['user']}")
             print(f"Computer: {lock_info['computer']}")
             print(f"Since: {lock_info['timestamp']}")
-            print(f"Lock file: {lock_path}")
+            print(f"Lock file: {self.lock_store.lock_path(os.path.basename(lock_path))}")
             return lock_info
         else:
             print(f"No lock found for: {os.path.basename(file_path)}")
@@ -164,23 +277,12 @@ class CADLockManager:
     
     def get_lock_path(self, file_path):
         """Generate lock file path in centralized directory"""
-        try:
-            # Get relative path from CAD root
-            rel_path = os.path.relpath(file_path, self.cad_root)
-        except ValueError:
-            # If file is not under CAD root, use full path
-            rel_path = file_path.replace(':', '_').replace('\\', '_').replace('/', '_')
-        
-        # Replace problematic characters with underscores
-        safe_path = rel_path.replace('\\', '_').replace('/', '_').replace(':', '_')
-        safe_path = safe_path.replace('*', '_').replace('?', '_').replace('"', '_')
-        safe_path = safe_path.replace('<', '_').replace('>', '_').replace('|', '_')
-        
-        lock_filename = f"{safe_path}.lock"
-        return os.path.join(self.lock_dir, lock_filename)
+        return self.lock_paths.lock_path(file_path)
     
     def open_solidworks(self, file_path, read_only=False):
         """Open SolidWorks with the specified file"""
+        import subprocess
+        
         try:
             if read_only:
                 print(f"Opening in READ-ONLY mode: {os.path.basename(file_path)}")
@@ -255,111 +357,278 @@ class CADLockManager:
             except:
                 pass
     
-    def cleanup_stale_locks(self, max_hours=24, force_cleanup_my_locks=False):
-        """Remove old lock files and optionally all auto-created locks"""
-        removed_count = 0
+    def cleanup_stale_locks(self, max_hours=None, force_cleanup_my_locks=False, open_files=None,
+                            include_expired=True, include_mine=True):
+        """Remove locks whose lease has expired and optionally all auto-created locks
         
-        if not os.path.exists(self.lock_dir):
-            return removed_count
+        A lease lasts max_hours (CLEANUP_MAX_HOURS) past its holder's last
+        heartbeat, and only expired leases and our own locks are looked at;
+        include_expired/include_mine limit it to one of the two.
+        open_files, when given, is the set of files the monitor just detected
+        as open; locks for those are kept without checking their temp file.
+        """
+        if max_hours is None:
+            max_hours = self.cleanup_max_hours
+        removed_count = 0
         
         try:
-            for lock_file in os.listdir(self.lock_dir):
-                if lock_file.endswith('.lock'):
-                    lock_path = os.path.join(self.lock_dir, lock_file)
-                    try:
-                        with open(lock_path, 'r') as f:
-                            lock_data = json.load(f)
-                        
-                        should_remove = False
-                        
-                        if force_cleanup_my_locks:
-                            # Remove all our auto-created locks (for when SolidWorks closes)
-                            if (lock_data.get('user') == self.user and 
-                                lock_data.get('auto_created', False)):
-                                should_remove = True
-                        else:
-                            # Check if lock is old
-                            lock_time = datetime.strptime(lock_data['timestamp'], "%Y-%m-%d %H:%M:%S")
-                            age_hours = (datetime.now() - lock_time).total_seconds() / 3600
-                            
-                            if age_hours > max_hours:
-                                should_remove = True
-                            
-                            # Also remove our auto-locks if corresponding temp file doesn't exist
-                            if (lock_data.get('user') == self.user and 
-                                lock_data.get('auto_created', False)):
-                                original_path = lock_data.get('original_path', '')
-                                if original_path:
-                                    # Check if temp file still exists
-                                    temp_file_path = os.path.join(
-                                        os.path.dirname(original_path),
-                                        '~$' + os.path.basename(original_path)
-                                    )
-                                    if not os.path.exists(temp_file_path):
-                                        should_remove = True
+            # Our own locks come from the manifest, so unlock-all reads one
+            # small file instead of listing the lock folder
+            my_locks = self.manifest.held() if include_mine or force_cleanup_my_locks else []
+            if force_cleanup_my_locks:
+                expired = {}
+                locks = my_locks
+            else:
+                expired = {}
+                if include_expired:
+                    expired = dict(self.lock_store.expired(self.lock_store.heartbeats(), max_hours * 3600))
+                locks = list(expired.items()) + [(lock_file, lock_data) for lock_file, lock_data in my_locks
+                                                 if lock_file not in expired]
+            
+            for lock_file, lock_data in locks:
+                lock_path = self.lock_store.lock_path(lock_file)
+                try:
+                    if lock_data is None:
+                        raise ValueError("unreadable lock file")
+                    
+                    should_remove = False
+                    
+                    if force_cleanup_my_locks:
+                        # Remove all our auto-created locks (for when SolidWorks closes)
+                        if (lock_data.get('user') == self.user and 
+                            lock_data.get('auto_created', False)):
+                            should_remove = True
+                    else:
+                        # Nobody has renewed the lease
+                        if lock_file in expired:
+                            should_remove = True
                         
-                        if should_remove:
-                            # Only remove if it's our lock or very old
-                            if (lock_data.get('user') == self.user or 
-                                (datetime.now() - datetime.strptime(lock_data['timestamp'], "%Y-%m-%d %H:%M:%S")).total_seconds() > max_hours * 3600):
-                                os.remove(lock_path)
-                                removed_count += 1
-                                if lock_data.get('auto_created'):
-                                    print(f"🔓 Auto-unlocked: {lock_data.get('file', lock_file)}")
-                                else:
-                                    print(f"🧹 Removed stale lock: {lock_data.get('file', lock_file)}")
+                        # Also remove our auto-locks if corresponding temp file doesn't exist
+                        if (lock_data.get('user') == self.user and 
+                            lock_data.get('auto_created', False)):
+                            original_path = lock_data.get('original_path') or self.lock_paths.original_path(lock_file)
+                            if original_path and (open_files is None or original_path not in open_files):
+                                # Check if temp file still exists
+                                temp_file_path = os.path.join(
+                                    os.path.dirname(original_path),
+                                    '~$' + os.path.basename(original_path)
+                                )
+                                if not os.path.exists(temp_file_path):
+                                    should_remove = True
                     
-                    except (json.JSONDecodeError, KeyError, ValueError, OSError) as e:
-                        # Remove corrupted lock files that are ours or very old
-                        try:
-                            file_age = (time.time() - os.path.getmtime(lock_path)) / 3600
-                            if file_age > max_hours:
-                                os.remove(lock_path)
-                                removed_count += 1
-                                print(f"🗑️ Removed corrupted lock: {lock_file}")
-                        except:
-                            pass
+                    if should_remove:
+                        self.lock_store.remove(lock_path)
+                        self.manifest.discard(lock_path)
+                        removed_count += 1
+                        if lock_data.get('auto_created'):
+                            print(f"🔓 Auto-unlocked: {lock_data.get('file', lock_file)}")
+                        else:
+                            print(f"🧹 Removed stale lock: {lock_data.get('file', lock_file)}")
+                
+                except (KeyError, ValueError, OSError) as e:
+                    # Remove corrupted lock files once their lease is up
+                    try:
+                        if lock_file in expired:
+                            self.lock_store.remove(lock_path)
+                            removed_count += 1
+                            print(f"🗑️ Removed corrupted lock: {self.lock_paths.original_path(lock_file) or lock_file}")
+                    except:
+                        pass
         
         except Exception as e:
             print(f"Error during cleanup: {e}")
         
         return removed_count
     
+    def sync_open_file_locks(self, cross_check=False):
+        """Detect open files, lock them and release locks for closed files
+        
+        Only files that opened or closed since the last sync touch the lock
+        folder. A cross_check sync also reconciles our locks: it retries
+        files someone else had locked and releases our locks for files that
+        closed unnoticed. Returns True if any file opened or closed.
+        """
+        # Find currently open files
+        open_files = self.detect_open_files(cross_check)
+        
+        if cross_check:
+            self.reconcile_open_files(open_files)
+        else:
+            for file_path in self.synced_files.keys() - open_files.keys():
+                if not self.release_closed_file(file_path):
+                    # Missed by a partial scan, still open
+                    open_files[file_path] = self.synced_files[file_path]
+            
+            for file_path in open_files.keys() - self.synced_files.keys():
+                self.lock_opened_file(file_path, open_files[file_path])
+        
+        return self.finish_sync(open_files)
+    
+    def lock_opened_file(self, file_path, method):
+        """Lock a file that opened since the last sync"""
+        if self.create_lock(file_path, auto_created=True, detection_method=method):
+            self.synced_locks.add(file_path)
+    
+    def release_closed_file(self, file_path):
+        """Release our lock on a file that closed since the last sync
+        
+        Returns False, keeping the lock, if its temp file is still there.
+        """
+        temp_path = os.path.join(os.path.dirname(file_path), '~$' + os.path.basename(file_path))
+        if os.path.exists(temp_path):
+            return False
+        if file_path in self.synced_locks:
+            self.remove_lock(file_path, auto_only=True)
+            self.synced_locks.discard(file_path)
+        return True
+    
+    def reconcile_open_files(self, open_files):
+        """Lock every open file and release our locks on all other files"""
+        self.start_reconcile()
+        
+        # Create locks for open files
+        for file_path, method in open_files.items():
+            self.lock_opened_file(file_path, method)
+        
+        self.release_unopened_locks(open_files)
+    
+    def start_reconcile(self):
+        """First step of a reconcile, shared by both monitor engines"""
+        # Drop manifest entries for locks that are gone, re-add missed ones
+        self.manifest.reseed()
+        self.synced_locks = set()
+    
+    def release_unopened_locks(self, open_files):
+        """Release our auto-locks on files that aren't open"""
+        # Folders with live locks (listed by the cleanup task) are likely
+        # to see temp files soon
+        for folder in self.live_lock_folders:
+            self.scanner.mark_hot(folder)
+        
+        # Clean up our locks for files that are no longer open
+        self.cleanup_stale_locks(open_files=open_files, include_expired=False)
+    
+    def finish_sync(self, open_files):
+        """Remember the open files for the next sync, returns True if they changed"""
+        changed = open_files.keys() != self.synced_files.keys()
+        self.synced_files = open_files
+        return changed
+    
+    def cleanup_expired_locks(self):
+        """Remove expired leases and note folders with live locks (background task)"""
+        removed = self.cleanup_stale_locks(include_mine=False)
+        if removed > 0:
+            print(f"🧹 Removed {removed} expired locks")
+        self.live_lock_folders = {os.path.dirname(lock_data['original_path'])
+                                  for lock_file, lock_data in self.lock_store.all()
+                                  if lock_data and lock_data.get('original_path')}
+    
+    def handle_watch_events(self, events):
+        """Create or remove locks for temp file events from the watcher"""
+        for kind, file_path in events:
+            if kind == 'open':
+                if os.path.exists(file_path):
+                    self.synced_files[file_path] = 'temp_file'
+                    if self.create_lock(file_path, auto_created=True):
+                        self.synced_locks.add(file_path)
+            else:
+                self.synced_files.pop(file_path, None)
+                self.synced_locks.discard(file_path)
+                self.remove_lock(file_path, auto_only=True)
+    
+    def start_watching(self):
+        """Announce the monitor settings and start the watcher, returns True if watching"""
+        print("🔍 Starting automatic lock monitoring...")
+        if self.detection_method == 'process_handles':
+            print("Detection method: SolidWorks file handles (temp file cross-check)")
+        else:
+            print("Detection method: SolidWorks temp files (~$ prefix)")
+        
+        watching = self.monitor_mode == 'watch' and self.watcher.start()
+        if watching:
+            print(f"👀 Watching for temp file events (full scan every {self.watch_rescan_interval}s)")
+        elif self.monitor_mode == 'watch':
+            print("⚠️ File watcher unavailable (pip install watchdog) - polling instead")
+        return watching
+    
     def auto_monitor_loop(self):
         """Background thread for automatic lock monitoring"""
-        print("🔍 Starting automatic lock monitoring...")
-        print(f"Detection method: SolidWorks temp files (~$ prefix)")
+        watching = self.start_watching()
+        last_scan = 0
+        wait = self.scheduler.next_wait()
         
         while self.auto_monitor_running:
             try:
-                if self.is_solidworks_running():
-                    # Find currently open files
-                    open_files = self.find_open_solidworks_files()
-                    
-                    # Create locks for open files
-                    for file_path in open_files:
-                        self.create_lock(file_path, auto_created=True)
+                # In watch mode, block until an event arrives or the interval passes
+                events = self.watcher.get_events(timeout=wait) if watching else []
+                if not self.auto_monitor_running:
+                    # Woken by stop_auto_monitor, don't start another cycle
+                    break
+                
+                if watching and not self.watcher.is_healthy():
+                    print("⚠️ File watcher lost events - running full scan")
+                    self.watcher.reset()
+                    last_scan = 0
+                
+                sw_running = self.is_solidworks_running()
+                changed = bool(events)
+                if sw_running:
+                    if events:
+                        self.handle_watch_events(events)
                     
-                    # Clean up locks for files that are no longer open
-                    self.cleanup_stale_locks(max_hours=24, force_cleanup_my_locks=False)
+                    # Polling scan every cycle, or as a safety net in watch mode.
+                    # Handle detection is cheap, so it runs every cycle and the
+                    # tree walk only runs as a periodic cross-check.
+                    scan_due = time.time() - last_scan >= self.watch_rescan_interval
+                    if not watching or scan_due or self.detection_method == 'process_handles':
+                        changed = self.sync_open_file_locks(cross_check=scan_due) or changed
+                        if scan_due:
+                            last_scan = time.time()
                 else:
                     # SolidWorks not running - clean up all our auto-locks
                     removed = self.cleanup_stale_locks(max_hours=0, force_cleanup_my_locks=True)
+                    self.synced_files = {}
+                    self.synced_locks = set()
                     if removed > 0:
                         print(f"🧹 SolidWorks closed - cleaned up {removed} auto-locks")
                 
-                # Wait before next check
-                time.sleep(10)  # Check every 10 seconds
+                # One heartbeat per cycle keeps all of our locks alive
+                self.lock_store.beat(self.user, self.computer)
+                
+                # Hand due slow tasks to the worker thread
+                self.tasks.run_due()
+                
+                # Sooner after activity, later while quiet
+                last_interval = self.scheduler.interval
+                self.scheduler.update(sw_running, changed)
+                wait = self.scheduler.next_wait()
+                if self.scheduler.interval != last_interval:
+                    print(f"⏱️ Checking every {self.scheduler.interval:g}s (next in {wait:.1f}s)")
+                
+                # Wait before next check, or until SolidWorks exits
+                if not watching:
+                    self.watcher.get_events(timeout=wait)
                 
             except Exception as e:
                 print(f"Error in auto-monitor: {e}")
                 time.sleep(5)
+        
+        self.watcher.stop()
     
     def start_auto_monitor(self):
         """Start automatic lock monitoring in background"""
         if not self.auto_monitor_running:
+            if self.scanner is None:
+                self._init_monitor()
             self.auto_monitor_running = True
-            self.monitor_thread = threading.Thread(target=self.auto_monitor_loop, daemon=True)
+            if self.monitor_engine == 'asyncio':
+                from async_monitor import AsyncMonitor
+                
+                self.async_monitor = AsyncMonitor(self, self.monitor_io_workers)
+                target = self.async_monitor.run
+            else:
+                target = self.auto_monitor_loop
+            self.monitor_thread = threading.Thread(target=target, daemon=True)
             self.monitor_thread.start()
             print("✅ Auto-monitor started")
             return True
@@ -371,6 +640,12 @@ class CADLockManager:
         """Stop automatic lock monitoring"""
         if self.auto_monitor_running:
             self.auto_monitor_running = False
+            if self.async_monitor:
+                self.async_monitor.stop()
+                self.async_monitor = None
+            # Either engine may be waiting on the watcher, wake it so the
+            # loop exits before our locks are cleaned up
+            self.watcher.wake()
             if self.monitor_thread:
                 self.monitor_thread.join(timeout=5)
             # Clean up all our auto-locks
@@ -385,11 +660,12 @@ def show_usage():
     print("  open           - Check lock and open file (creates manual lock)")
     print("  lock           - Create manual lock for file")
     print("  unlock         - Remove lock for file")
-    print("  unlock-all     - Remove ALL locks created by current user")
-    print("  cleanup [hrs]  - Remove stale locks older than hrs (default: 24)")
+    print("  unlock-all     - Remove your locks held from this computer")
+    print("  cleanup [hrs]  - Remove locks not renewed for hrs (default: CLEANUP_MAX_HOURS)")
     print("  check          - Check lock status")
     print("  start-monitor  - Start automatic background monitoring")
     print("  stop-monitor   - Stop automatic background monitoring")
+    print("  migrate-locks  - Move lock files into the LOCK_LAYOUT folder layout")
     print("\nExamples:")
     print('  python main.py open "G:\\path\\to\\file.sldprt"')
     print('  python main.py check "G:\\path\\to\\file.sldprt"')
@@ -398,12 +674,14 @@ def show_usage():
     print('  python main.py start-monitor')
     print("\nAuto-Monitor Features:")
     print("  • Detects open SolidWorks files via temp files (~$ prefix)")
+    print("  • Reacts to temp file events instantly (MONITOR_MODE=watch)")
+    print("  • Can read SolidWorks file handles instead (DETECTION_METHOD=process_handles)")
     print("  • Creates/removes locks automatically")
     print("  • Cleans up when SolidWorks closes")
     print("  • Runs in background until stopped")
 
-# Main execution
-if __name__ == "__main__":
+def main():
+    """Run the command line interface"""
     if len(sys.argv) < 2:
         show_usage()
         input("\nPress Enter to continue...")
@@ -412,8 +690,8 @@ if __name__ == "__main__":
     action = sys.argv[1].lower()
     
     # Actions that don't need a file path
-    if action in ["unlock-all", "start-monitor", "stop-monitor"]:
-        manager = CADLockManager()
+    if action in ["unlock-all", "start-monitor", "stop-monitor", "migrate-locks"]:
+        manager = CADLockManager(validate=action == "start-monitor")
         
         if action == "unlock-all":
             removed = manager.cleanup_stale_locks(max_hours=0, force_cleanup_my_locks=True)
@@ -429,22 +707,28 @@ if __name__ == "__main__":
                 manager.stop_auto_monitor()
         elif action == "stop-monitor":
             manager.stop_auto_monitor()
+        elif action == "migrate-locks":
+            if hasattr(manager.lock_store, 'migrate'):
+                moved = manager.lock_store.migrate()
+                print(f"Moved {moved} locks into the '{manager.lock_layout}' layout")
+            else:
+                print("migrate-locks only applies to LOCK_BACKEND=file")
         
         time.sleep(2)
         sys.exit(0)
     
     # Cleanup action (optional file path)
     if action == "cleanup":
-        hours = 24
+        manager = CADLockManager(validate=False)
+        hours = manager.cleanup_max_hours
         if len(sys.argv) > 2:
             try:
-                hours = int(sys.argv[2])
+                hours = float(sys.argv[2])
             except ValueError:
-                hours = 24
+                pass
         
-        manager = CADLockManager()
         removed = manager.cleanup_stale_locks(max_hours=hours)
-        print(f"Removed {removed} stale locks older than {hours} hours")
+        print(f"Removed {removed} locks with leases expired over {hours:g} hours")
         time.sleep(2)
         sys.exit(0)
     
@@ -462,7 +746,9 @@ if __name__ == "__main__":
         input("\nPress Enter to continue...")
         sys.exit(1)
     
-    manager = CADLockManager()
+    # One-shot file commands skip checking CAD_ROOT_DIR and SOLIDWORKS_PATH;
+    # open reports a bad SolidWorks path if launching it fails
+    manager = CADLockManager(validate=False)
     
     if action == "open":
         # Check if file is locked
@@ -492,6 +778,8 @@ if __name__ == "__main__":
             except ImportError:
                 # Fallback: Use Windows msg command if tkinter not available
                 try:
+                    import subprocess
+                    
                     message = f"File Locked!\\n\\nFile: {os.path.basename(file_path)}\\nLocked by: {lock_info['user']}\\nComputer: {lock_info['computer']}\\nSince: {lock_info['timestamp']}\\n\\nOpening in READ-ONLY mode."
                     subprocess.run(['msg', '*', message], shell=True, timeout=10)
                 except:
@@ -512,6 +800,8 @@ if __name__ == "__main__":
         else:
             # File is not locked or locked by current user - create lock and open normally
             if manager.create_lock(file_path, auto_created=False):
+                # Let the monitor treat this file's folder as hot
+                record_recent_open(file_path)
                 manager.open_solidworks(file_path, read_only=False)
             else:
                 # Lock creation failed - open read-only
@@ -532,4 +822,8 @@ if __name__ == "__main__":
         
     # Keep window open briefly so user can see the output (but hidden)
     if action not in ["start-monitor", "stop-monitor"]:
-        time.sleep(1)  # Reduced from 2 seconds and only for non-monitor actions
\ No newline at end of file
+        time.sleep(1)  # Reduced from 2 seconds and only for non-monitor actions
+
+# Main execution
+if __name__ == "__main__":
+    main()
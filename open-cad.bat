@@ -32,11 +32,11 @@ if not defined INSTALL_DIR (
   exit /b 1
 )
 
-REM Build full path to main.py
+REM Build full path to the agent client (it falls back to main.py)
 if "%INSTALL_DIR:~-1%"=="\" (
-  set "INSTALL_PATH=%INSTALL_DIR%main.py"
+  set "INSTALL_PATH=%INSTALL_DIR%agent.py"
 ) else (
-  set "INSTALL_PATH=%INSTALL_DIR%\main.py"
+  set "INSTALL_PATH=%INSTALL_DIR%\agent.py"
 )
 
 REM If no file is passed, just open SolidWorks
@@ -45,5 +45,6 @@ if "%~1"=="" (
   exit /b 0
 )
 
-REM If a file is passed, always check locks first
+REM If a file is passed, always check locks first. The running tray takes
+REM the lock at once; without it this runs 'main.py open'.
 python "%INSTALL_PATH%" open "%~1"
\ No newline at end of file
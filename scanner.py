@@ -0,0 +1,506 @@
+import fnmatch
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from local_state import load_state, save_state
+
+# SolidWorks document extensions that get a ~$ temp file while open
+CAD_EXTENSIONS = ('.sldprt', '.sldasm', '.slddrw')
+
+# Directory mtimes this close to the listing time are not trusted, because a
+# second change inside the same timestamp tick would go unnoticed
+MTIME_SETTLE_SECONDS = 2.0
+
+# Folders that can never hold an open document
+DEFAULT_EXCLUDE_GLOBS = '.git;.svn;$RECYCLE.BIN;System Volume Information'
+
+
+def is_cad_temp_file(name):
+    """Check if a file name is a SolidWorks temp file for a CAD document"""
+    return name.startswith('~$') and name.lower().endswith(CAD_EXTENSIONS)
+
+
+def _split_setting(value):
+    """Split a ';'-separated config value into its non-empty parts"""
+    return [part.strip() for part in value.split(';') if part.strip()]
+
+
+class ExclusionRules:
+    """Folders to prune from the scan, compiled once
+
+    Globs without a path separator match a folder's name (".git",
+    "Archive"); globs with one match its path relative to the root
+    ("Projects/*/Releases"). Both are compiled into a single case-insensitive
+    regex each. Path prefixes (absolute, or relative to the root) go into a
+    trie of path components so any folder at or below a prefix is rejected
+    in one pass over its components.
+    """
+
+    def __init__(self, root, globs=(), prefixes=()):
+        self.root = os.path.abspath(root)
+        self.globs = list(globs)
+        self.prefixes = list(prefixes)
+
+        name_globs = [g for g in self.globs if '/' not in g and '\\' not in g]
+        path_globs = [g.replace('\\', '/') for g in self.globs if '/' in g or '\\' in g]
+        self.name_re = self._compile(name_globs)
+        self.path_re = self._compile(path_globs)
+
+        # Nested dicts keyed by path component; None marks the end of a prefix
+        self.trie = {}
+        for prefix in self.prefixes:
+            node = self.trie
+            for part in self._components(prefix):
+                node = node.setdefault(part, {})
+            node[None] = True
+
+    def _compile(self, globs):
+        if not globs:
+            return None
+        return re.compile('|'.join(fnmatch.translate(g) for g in globs), re.IGNORECASE)
+
+    def _components(self, path):
+        full_path = os.path.normcase(os.path.normpath(os.path.join(self.root, path)))
+        return full_path.split(os.sep)
+
+    def excludes(self, path, name=None):
+        """Check if a folder (and so its whole subtree) should be skipped"""
+        if self.name_re and self.name_re.match(name or os.path.basename(path)):
+            return True
+
+        if self.path_re:
+            rel_path = os.path.relpath(path, self.root).replace(os.sep, '/')
+            if self.path_re.match(rel_path):
+                return True
+
+        if self.trie:
+            node = self.trie
+            for part in self._components(path):
+                node = node.get(part)
+                if node is None:
+                    return False
+                if None in node:
+                    return True
+        return False
+
+    def excludes_tree(self, path):
+        """Check if a folder or any of its parents below the root is excluded"""
+        rel_path = os.path.relpath(path, self.root)
+        if rel_path == os.curdir or rel_path.startswith(os.pardir):
+            return self.excludes(path)
+
+        current = self.root
+        for part in rel_path.split(os.sep):
+            current = os.path.join(current, part)
+            if self.excludes(current, part):
+                return True
+        return False
+
+    def describe(self):
+        """Return a short human-readable summary of the rules"""
+        return f"{len(self.globs)} globs, {len(self.prefixes)} path prefixes"
+
+
+def rules_from_env(cad_root, lock_dir):
+    """Build exclusion rules from SCAN_EXCLUDE_GLOBS / SCAN_EXCLUDE_PATHS
+
+    The lock directory is always excluded.
+    """
+    globs = _split_setting(os.getenv('SCAN_EXCLUDE_GLOBS', DEFAULT_EXCLUDE_GLOBS))
+    prefixes = _split_setting(os.getenv('SCAN_EXCLUDE_PATHS', ''))
+    return ExclusionRules(cad_root, globs, prefixes + [lock_dir])
+
+
+class IncrementalScanner:
+    """Find SolidWorks temp files, re-listing only directories whose mtime changed
+
+    Every directory seen under the root is cached with its mtime, its
+    sub-directories and the ~$ temp files it contained. On the next scan a
+    directory is only listed again if its mtime moved; otherwise the cached
+    entries are reused and only a stat is paid. Adding, removing or renaming
+    an entry updates the parent directory's mtime, so the result matches a
+    full os.walk. A full rescan that ignores the cache runs every
+    full_rescan_interval seconds as a safety net for drives that don't
+    maintain directory mtimes reliably.
+
+    With workers > 1, sibling directories are stat'ed and listed
+    concurrently on a thread pool. On network drives each round trip is
+    latency-bound, so throughput scales with the number of workers.
+
+    With cold_scan_interval > 0 the tree is split into two tiers. Hot
+    directories (ones that recently held ~$ files, live locks or files the
+    user opened) are checked every hot_scan_interval seconds. The cold
+    top-level subtrees of the root are revisited on a rotation so that each
+    one is checked at least every cold_scan_interval seconds. Results for
+    directories not checked this cycle come from the cache.
+
+    Folders matched by the exclusion rules are pruned while their parent is
+    listed, so nothing below them is ever stat'ed or listed.
+
+    iter_open_files() accepts an I/O time budget. When it runs out, the
+    tree walk in progress stops and the directories still to visit are kept
+    as a cursor; the next call resumes from there. If cursor_name is set,
+    the cursor (plus the directories known to hold temp files) is saved to
+    local state so a restarted monitor picks up where it left off.
+    """
+
+    def __init__(self, root, full_rescan_interval=600, workers=1,
+                 hot_scan_interval=0, cold_scan_interval=0, hot_ttl=3600, max_hot_dirs=200,
+                 cursor_name=None, rules=None):
+        self.root = root
+        self.full_rescan_interval = full_rescan_interval
+        self.workers = max(1, workers)
+        self.pool = None
+        self.rules = rules
+
+        # Hot/cold tiers
+        self.hot_scan_interval = hot_scan_interval
+        self.cold_scan_interval = cold_scan_interval
+        self.hot_ttl = hot_ttl
+        self.max_hot_dirs = max_hot_dirs
+
+        # dir path -> (mtime_ns or None, [sub-dir paths], [(temp name, original exists)],
+        #              number of sub-directories pruned by the exclusion rules)
+        self.cache = {}
+        # Cached directories that hold at least one ~$ file
+        self.temp_dirs = set()
+        self.last_full_scan = 0
+
+        # dir -> last time it held temp files / a lock / a recent open
+        self.hot_dirs = {}
+        # dir -> last time the hot tier checked it
+        self.hot_checked = {}
+        # top-level subtree -> last time the cold rotation walked it
+        self.subtree_checked = {}
+
+        # Tree walk in progress: {'kind', 'use_cache', 'pending', 'subtrees'}
+        self.walk = None
+        self.cursor_name = cursor_name
+        self.cursor_loaded = False
+        # True once a whole-tree walk has finished, i.e. results cover every folder
+        self.complete = False
+
+        # Stats from the last scan
+        self.last_temp_count = 0
+        self.dirs_listed = 0
+        self.dirs_reused = 0
+        self.dirs_pruned = 0
+        self.last_scan_was_full = False
+
+    def _list_dir(self, path):
+        """List a directory, returning its sub-directories, temp files and pruned count"""
+        subdirs = []
+        names = set()
+        temp_names = []
+        pruned = 0
+
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir() and not entry.is_symlink():
+                        if self.rules and self.rules.excludes(entry.path, entry.name):
+                            pruned += 1
+                        else:
+                            subdirs.append(entry.path)
+                        continue
+                except OSError:
+                    continue
+                names.add(entry.name.lower())
+                if entry.name.startswith('~$'):
+                    temp_names.append(entry.name)
+
+        # The original document sits next to its temp file, so the listing
+        # already tells us whether it exists
+        temp_files = [(name, name[2:].lower() in names) for name in temp_names]
+        return subdirs, temp_files, pruned
+
+    def _scan_dir(self, path, use_cache):
+        """Return (path, cache entry, listed) for one directory, listing it only if needed"""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return path, None, False
+
+        cached = self.cache.get(path)
+        if use_cache and cached and cached[0] is not None and cached[0] == mtime_ns:
+            return path, cached, False
+
+        try:
+            subdirs, temp_files, pruned = self._list_dir(path)
+        except OSError:
+            return path, None, False
+
+        if time.time() - mtime_ns / 1e9 < MTIME_SETTLE_SECONDS:
+            mtime_ns = None
+        return path, (mtime_ns, subdirs, temp_files, pruned), True
+
+    def _should_descend(self, subdir, recursive):
+        """Walk into a sub-directory if recursing, or if we have never seen it"""
+        return recursive or subdir not in self.cache
+
+    def _walk_serial(self, pending, use_cache, recursive, deadline):
+        """Scan directories one after another until pending is empty or time runs out"""
+        while pending and not (deadline and time.time() >= deadline):
+            result = self._scan_dir(pending.pop(), use_cache)
+            if result[1] is not None:
+                pending.extend(d for d in result[1][1] if self._should_descend(d, recursive))
+            yield result
+
+    def _walk_parallel(self, pending, use_cache, recursive, deadline):
+        """Scan directories on the thread pool, yielding results as they complete"""
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cad-scan')
+
+        in_flight = set()
+        while pending or in_flight:
+            # Keep the workers busy, but stop handing out work once out of time
+            while pending and len(in_flight) < self.workers * 2 and not (deadline and time.time() >= deadline):
+                in_flight.add(self.pool.submit(self._scan_dir, pending.pop(), use_cache))
+            if not in_flight:
+                break
+
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result[1] is not None:
+                    pending.extend(d for d in result[1][1] if self._should_descend(d, recursive))
+                yield result
+
+    def _store(self, path, entry):
+        """Update the cache for one directory, dropping sub-directories that vanished"""
+        old = self.cache.get(path)
+        if old is not None and old is not entry:
+            for subdir in set(old[1]) - set(entry[1]):
+                self._purge(subdir)
+
+        self.cache[path] = entry
+        if entry[2]:
+            self.temp_dirs.add(path)
+        else:
+            self.temp_dirs.discard(path)
+
+    def _purge(self, path):
+        """Forget a directory and everything cached below it"""
+        pending = [path]
+        while pending:
+            path = pending.pop()
+            entry = self.cache.pop(path, None)
+            self.temp_dirs.discard(path)
+            self.hot_dirs.pop(path, None)
+            self.hot_checked.pop(path, None)
+            if entry is not None:
+                pending.extend(entry[1])
+
+    def _refresh(self, pending, use_cache, recursive, now, deadline=None):
+        """Walk from the pending directories, updating the cache and yielding open files
+
+        Directories left in pending when the deadline passes have not been visited.
+        """
+        walk_fn = self._walk_parallel if self.workers > 1 else self._walk_serial
+
+        for path, entry, listed in walk_fn(pending, use_cache, recursive, deadline):
+            if entry is None:
+                self._purge(path)
+                continue
+            self._store(path, entry)
+            if listed:
+                self.dirs_listed += 1
+            else:
+                self.dirs_reused += 1
+            self.dirs_pruned += entry[3]
+
+            if entry[2]:
+                self.hot_dirs[path] = now
+                self.hot_checked[path] = now
+            for name, original_exists in entry[2]:
+                if original_exists and name.lower().endswith(CAD_EXTENSIONS):
+                    yield os.path.join(path, name[2:])
+
+    def _stagger_subtrees(self, now):
+        """Spread the cold subtrees over the rotation after a whole-tree walk"""
+        subtrees = sorted(self.cache[self.root][1]) if self.root in self.cache else []
+        count = len(subtrees)
+        self.subtree_checked = {
+            subtree: now - self.cold_scan_interval * index / count
+            for index, subtree in enumerate(subtrees)
+        }
+
+    def mark_hot(self, path, when=None):
+        """Promote a directory to the hot tier (ignored if it is not in the scanned tree)"""
+        path = os.path.normpath(path)
+        if path not in self.cache:
+            return False
+        when = when or time.time()
+        if when > self.hot_dirs.get(path, 0):
+            self.hot_dirs[path] = when
+        return True
+
+    def ranked_hot_dirs(self):
+        """Return hot directories, most recently active first"""
+        ranked = sorted(self.hot_dirs, key=self.hot_dirs.get, reverse=True)
+        return ranked[:self.max_hot_dirs]
+
+    def staleness(self, now=None):
+        """Return how many seconds old the stalest hot dir and cold subtree are"""
+        now = now or time.time()
+        hot = [now - self.hot_checked.get(d, 0) for d in self.ranked_hot_dirs()]
+        cold = [now - t for t in self.subtree_checked.values()]
+        return {
+            'hot': max(hot, default=0.0),
+            'cold': max(cold, default=0.0),
+            'hot_dirs': len(hot),
+            'cold_subtrees': len(cold),
+        }
+
+    def _start_walk(self, now, force_full):
+        """Begin a new tree walk if one is due"""
+        full_scan = force_full or now - self.last_full_scan >= self.full_rescan_interval
+
+        if full_scan or self.cold_scan_interval <= 0 or self.root not in self.cache:
+            # Whole tree, trusting cached listings unless the safety net is due
+            self.walk = {'kind': 'full' if full_scan else 'tree', 'use_cache': not full_scan,
+                         'pending': [self.root], 'subtrees': []}
+            return
+
+        # Cold tier: subtrees whose turn in the rotation has come. Pending is
+        # popped from the end, so the oldest subtree goes last.
+        due = sorted((s for s in self.subtree_checked if now - self.subtree_checked[s] >= self.cold_scan_interval),
+                     key=self.subtree_checked.get, reverse=True)
+        if due:
+            self.walk = {'kind': 'cold', 'use_cache': True, 'pending': due, 'subtrees': list(due)}
+
+    def _finish_walk(self, now):
+        """Record a completed tree walk"""
+        if self.walk['kind'] == 'cold':
+            for subtree in self.walk['subtrees']:
+                self.subtree_checked[subtree] = now
+        else:
+            self._stagger_subtrees(now)
+            self.hot_checked = dict.fromkeys(self.hot_dirs, now)
+            self.complete = True
+            if self.walk['kind'] == 'full':
+                self.last_full_scan = now
+        self.walk = None
+
+    def _load_cursor(self):
+        """Restore an unfinished walk and known temp-file folders from local state"""
+        self.cursor_loaded = True
+        state = load_state(self.cursor_name)
+        if not state or state.get('root') != self.root:
+            return
+
+        now = time.time()
+        self.walk = state.get('walk')
+        if self.walk and self.rules:
+            # The rules may have changed since the cursor was saved
+            self.walk['pending'] = [d for d in self.walk['pending'] if not self.rules.excludes_tree(d)]
+        self.last_full_scan = state.get('last_full_scan', 0)
+        self.subtree_checked = state.get('subtree_checked', {})
+
+        # Folders that held temp files; mtime None forces a fresh listing
+        for path, temp_files in state.get('temp_dirs', {}).items():
+            if self.rules and self.rules.excludes_tree(path):
+                continue
+            self.cache[path] = (None, [], [tuple(t) for t in temp_files], 0)
+            self.temp_dirs.add(path)
+            self.hot_dirs[path] = now
+
+    def _save_cursor(self):
+        """Persist the walk in progress so a restart can resume it"""
+        save_state(self.cursor_name, {
+            'root': self.root,
+            'walk': self.walk,
+            'last_full_scan': self.last_full_scan,
+            'subtree_checked': self.subtree_checked,
+            'temp_dirs': {path: self.cache[path][2] for path in self.temp_dirs},
+        })
+
+    def iter_open_files(self, force_full=False, budget=None):
+        """Yield CAD documents that have a ~$ temp file as soon as they are found
+
+        budget caps the seconds spent walking the tree this call; an unfinished
+        walk resumes from its cursor on the next call.
+        """
+        now = time.time()
+        deadline = now + budget if budget else None
+        if self.cursor_name and not self.cursor_loaded:
+            self._load_cursor()
+
+        self.dirs_listed = 0
+        self.dirs_reused = 0
+        self.dirs_pruned = 0
+
+        # Let directories that have been quiet for a while cool down
+        self.hot_dirs = {d: t for d, t in self.hot_dirs.items() if now - t <= self.hot_ttl}
+        self.hot_checked = {d: t for d, t in self.hot_checked.items() if d in self.hot_dirs}
+
+        had_walk = self.walk is not None
+        if force_full or self.walk is None:
+            self._start_walk(now, force_full)
+        self.last_scan_was_full = self.walk is not None and self.walk['kind'] == 'full'
+
+        found = set()
+        if self.cold_scan_interval > 0 and self.root in self.cache:
+            # Hot tier: just the directories themselves (plus any new sub-directories)
+            hot = [d for d in self.ranked_hot_dirs()
+                   if now - self.hot_checked.get(d, 0) >= self.hot_scan_interval]
+            for original_path in self._refresh(list(hot), True, False, now):
+                found.add(original_path)
+                yield original_path
+            for d in hot:
+                self.hot_checked[d] = now
+
+            # The root itself is cheap and picks up new or removed top-level folders
+            for original_path in self._refresh([self.root], True, False, now):
+                found.add(original_path)
+                yield original_path
+            subtrees = self.cache[self.root][1] if self.root in self.cache else []
+            self.subtree_checked = {s: self.subtree_checked.get(s, now) for s in subtrees}
+
+        # Tree walk, resumed from the cursor, until done or out of time
+        if self.walk is not None:
+            for original_path in self._refresh(self.walk['pending'], self.walk['use_cache'],
+                                               True, now, deadline):
+                found.add(original_path)
+                yield original_path
+            if not self.walk['pending']:
+                self._finish_walk(now)
+
+        if self.cursor_name and (had_walk or self.walk is not None):
+            self._save_cursor()
+
+        # Everything else comes from the cache
+        self.last_temp_count = 0
+        for path in list(self.temp_dirs):
+            for name, original_exists in self.cache[path][2]:
+                self.last_temp_count += 1
+                if original_exists and name.lower().endswith(CAD_EXTENSIONS):
+                    original_path = os.path.join(path, name[2:])
+                    if original_path not in found:
+                        found.add(original_path)
+                        yield original_path
+
+    def scan_in_progress(self):
+        """Check if a tree walk is paused waiting for the next call"""
+        return self.walk is not None
+
+    def scan(self, force_full=False, budget=None):
+        """Return the set of CAD documents that currently have a ~$ temp file"""
+        return set(self.iter_open_files(force_full, budget))
+
+    def close(self):
+        """Shut down the worker pool"""
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def invalidate(self, path=None):
+        """Forget cached listings (all of them, or one directory)"""
+        if path is None:
+            self.cache = {}
+            self.temp_dirs = set()
+            self.last_full_scan = 0
+        else:
+            self._purge(path)
@@ -0,0 +1,136 @@
+import hashlib
+import queue
+import random
+import threading
+import time
+
+
+class MonitorScheduler:
+    """Decide how long the monitor waits between cycles
+
+    Right after activity (SolidWorks starting, documents opening or closing)
+    the interval drops to min_interval. Each quiet cycle doubles it, up to
+    active_interval while SolidWorks runs and idle_interval while it doesn't.
+    Every wait is skewed by a fixed per-computer fraction plus a random one,
+    together within +/- jitter, so stations sharing a drive don't poll in
+    lock-step.
+    """
+
+    def __init__(self, computer, min_interval=2, active_interval=10, idle_interval=60, jitter=0.2):
+        self.min_interval = max(min_interval, 0.5)
+        self.active_interval = max(active_interval, self.min_interval)
+        self.idle_interval = max(idle_interval, self.min_interval)
+        self.jitter = jitter
+        self.interval = self.min_interval
+        self.solidworks_running = False
+
+        # Same skew on every start, different on every computer
+        digest = hashlib.sha1(str(computer).encode('utf-8')).digest()
+        self.skew = (digest[0] / 255 - 0.5) * jitter
+        self.random = random.Random()
+
+    def update(self, solidworks_running, changed=False):
+        """Adjust the interval after a cycle"""
+        if changed or (solidworks_running and not self.solidworks_running):
+            self.interval = self.min_interval
+        else:
+            limit = self.active_interval if solidworks_running else self.idle_interval
+            self.interval = min(self.interval * 2, limit)
+        self.solidworks_running = solidworks_running
+
+    def next_wait(self):
+        """Return seconds to wait before the next cycle, jitter included"""
+        spread = self.skew + self.random.uniform(-self.jitter, self.jitter) / 2
+        return max(self.interval * (1 + spread), 0.5)
+
+
+class _Task:
+    def __init__(self, name, func, interval, background, when):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.background = background
+        self.when = when
+        self.next_run = 0
+        self.pending = False
+
+
+class TaskScheduler:
+    """Run the monitor's tasks, each on its own cadence
+
+    A task runs when its interval has passed since its last run, when its
+    when() check returns True, or after trigger(). when() is called on every
+    run_due() while the task isn't running, so its state stays current.
+    Foreground tasks run on the monitor thread in the order they were added.
+    Background tasks, and one-off jobs passed to defer(), run one at a time
+    on a worker thread, so a slow cleanup, scan or popup never holds up
+    locking a newly opened file.
+    A background task isn't queued again while its last run is unfinished.
+    """
+
+    def __init__(self, log=print):
+        self.log = log
+        self.tasks = []
+        self.jobs = queue.Queue()
+        self.worker = None
+
+    def add(self, name, func, interval, background=False, when=None):
+        """Add a task run every interval seconds (and whenever when() is True)"""
+        self.tasks.append(_Task(name, func, interval, background, when))
+
+    def trigger(self, name):
+        """Make a task due on the next run_due()"""
+        for task in self.tasks:
+            if task.name == name:
+                task.next_run = 0
+
+    def run_due(self):
+        """Run due foreground tasks and queue due background tasks"""
+        for task in self.tasks:
+            if task.pending:
+                continue
+            # Check when() even if the interval is up, so a check that
+            # remembers what it last saw doesn't report the same change twice
+            changed = task.when() if task.when else False
+            now = time.time()
+            if now < task.next_run and not changed:
+                continue
+
+            task.next_run = now + task.interval
+            if task.background:
+                task.pending = True
+                self._queue(task)
+            else:
+                self._run(task)
+
+    def defer(self, func, *args):
+        """Run a one-off job on the worker thread"""
+        self._queue(lambda: func(*args))
+
+    def _queue(self, job):
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._work, daemon=True)
+            self.worker.start()
+        self.jobs.put(job)
+
+    def _run(self, task):
+        started = time.time()
+        try:
+            task.func()
+        except Exception as e:
+            self.log(f"Task {task.name} failed: {e}")
+        elapsed = time.time() - started
+        if task.interval and elapsed > task.interval:
+            self.log(f"Task {task.name} took {elapsed:.1f}s (runs every {task.interval:g}s)")
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if isinstance(job, _Task):
+                self._run(job)
+                job.pending = False
+            else:
+                try:
+                    job()
+                except Exception as e:
+                    self.log(f"Background job failed: {e}")
@@ -1,14 +1,21 @@
 import os
-import json
-import sys
 import time
 import threading
 from datetime import datetime
-import psutil
-import pystray
-from PIL import Image, ImageDraw
-import tkinter as tk
-from tkinter import messagebox
+
+# tkinter is only loaded when a popup is shown, pystray and PIL when the
+# icon is drawn
+
+from agent import AgentServer
+from local_state import load_recent_opens, record_recent_open
+from lock_manifest import LockManifest
+from lock_paths import LockPathMapper
+from lock_record import make_lock_record
+from lock_store import open_lock_store
+from scanner import IncrementalScanner, rules_from_env
+from scheduler import MonitorScheduler, TaskScheduler
+from sw_process import SolidWorksTracker, find_open_documents
+from watcher import TempFileWatcher
 
 # Simple version with collision detection
 class SimpleCADTray:
@@ -21,7 +28,65 @@ class SimpleCADTray:
         self.cad_root = os.getenv('CAD_ROOT_DIR', r"G:\Shared drives\Cosmic\Engineering\50 - CAD Data")
         
         # Get settings
-        self.monitor_interval = int(os.getenv('MONITOR_INTERVAL', '10'))
+        self.cleanup_max_hours = float(os.getenv('CLEANUP_MAX_HOURS', '24'))
+        self.monitor_interval = float(os.getenv('MONITOR_INTERVAL', '10'))
+        self.full_rescan_interval = int(os.getenv('FULL_RESCAN_INTERVAL', '600'))
+        self.scan_workers = int(os.getenv('SCAN_WORKERS', '8'))
+        self.hot_scan_interval = int(os.getenv('HOT_SCAN_INTERVAL', '0'))
+        self.cold_scan_interval = int(os.getenv('COLD_SCAN_INTERVAL', '0'))
+        self.scan_budget = float(os.getenv('SCAN_BUDGET_SECONDS', '2'))
+        
+        # Temp-file scanner keeps a directory cache between monitor cycles,
+        # lists sibling directories concurrently on SCAN_WORKERS threads and
+        # checks hot folders more often than the cold rest of the tree. Walks
+        # that overrun SCAN_BUDGET_SECONDS resume from a saved cursor, and
+        # excluded folders (including the lock directory) are never entered.
+        self.scan_rules = rules_from_env(self.cad_root, self.lock_dir)
+        self.scanner = IncrementalScanner(self.cad_root, self.full_rescan_interval, self.scan_workers,
+                                          hot_scan_interval=self.hot_scan_interval,
+                                          cold_scan_interval=self.cold_scan_interval,
+                                          cursor_name='scan_cursor_tray.json',
+                                          rules=self.scan_rules)
+        
+        # 'watch' reacts to temp file events and only polls as a fallback,
+        # 'poll' scans the CAD tree every cycle
+        self.monitor_mode = os.getenv('MONITOR_MODE', 'watch').lower()
+        self.watch_rescan_interval = int(os.getenv('WATCH_RESCAN_INTERVAL', '300'))
+        self.watcher = TempFileWatcher(self.cad_root, rules=self.scan_rules)
+        
+        # SLDWORKS processes are checked by PID once found; their exit wakes
+        # the monitor loop so our locks are released right away
+        self.process_rescan_interval = int(os.getenv('PROCESS_RESCAN_INTERVAL', '60'))
+        self.solidworks = SolidWorksTracker(self.process_rescan_interval, on_exit=self.watcher.wake)
+        
+        # Cycle interval: short after activity, backing off to MONITOR_INTERVAL
+        # while SolidWorks is quiet and MONITOR_IDLE_INTERVAL while it's closed
+        self.scheduler = MonitorScheduler(self.computer,
+                                          min_interval=float(os.getenv('MONITOR_MIN_INTERVAL', '2')),
+                                          active_interval=self.monitor_interval,
+                                          idle_interval=float(os.getenv('MONITOR_IDLE_INTERVAL', '60')),
+                                          jitter=float(os.getenv('MONITOR_JITTER', '0.2')))
+        
+        # 'temp_file' walks the tree for ~$ files, 'process_handles' reads the
+        # files SolidWorks holds open and uses the walk only as a cross-check
+        self.detection_method = os.getenv('DETECTION_METHOD', 'temp_file').lower()
+        self.temp_only_files = set()
+        
+        # Open files from the last sync, to tell the scheduler about changes
+        self.last_open_files = set()
+        self.open_files_changed = False
+        
+        # 'file' keeps one .lock file per lock (parsed once, re-read only when
+        # its mtime/size changes), 'journal' an append-only log plus snapshot
+        self.lock_backend = os.getenv('LOCK_BACKEND', 'file').lower()
+        # 'flat' keeps every lock in the lock folder, 'project'/'hash' shard them
+        self.lock_layout = os.getenv('LOCK_LAYOUT', 'flat').lower()
+        self.lock_store = open_lock_store(self.lock_dir, self.lock_backend, self.lock_layout,
+                                          self.user, self.computer)
+        self.lock_paths = LockPathMapper(self.cad_root, self.lock_dir, layout=self.lock_layout)
+        
+        # Locks held from this computer, so "my locks" needs no folder listing
+        self.manifest = LockManifest(self.user, self.computer, self.lock_store, self.lock_paths)
         
         self.monitor_running = False
         self.monitor_thread = None
@@ -34,6 +99,22 @@ class SimpleCADTray:
         self.collision_active = False
         self.animation_thread = None
         
+        # The conflict scan lists every lock and may wait on a popup, so it
+        # runs on a worker thread when the lock folder changes (or every
+        # CONFLICT_SCAN_INTERVAL seconds) and never delays taking a lock
+        self.conflict_scan_interval = int(os.getenv('CONFLICT_SCAN_INTERVAL', '60'))
+        self.conflicts_found = False
+        self.live_lock_folders = set()
+        self.lock_dir_mtime = None
+        self.tasks = TaskScheduler(log=self.log_message)
+        self.tasks.add('conflicts', self.check_for_multiple_locks, self.conflict_scan_interval,
+                       background=True, when=self.lock_dir_changed)
+        
+        # Local agent: open-cad.bat hands 'open' requests to this process,
+        # whose lock state is already warm, instead of starting main.py
+        self.agent_enabled = os.getenv('AGENT_ENABLED', '1') == '1'
+        self.agent = AgentServer(self.handle_agent_request, log=self.log_message)
+        
         # Ensure directories exist
         os.makedirs(self.lock_dir, exist_ok=True)
         
@@ -49,6 +130,8 @@ class SimpleCADTray:
     
     def create_simple_icon(self, lock_count=0, warning=False):
         """Create a very simple icon"""
+        from PIL import Image, ImageDraw
+        
         # Create a simple 32x32 icon
         if warning:
             image = Image.new('RGBA', (32, 32), (255, 0, 0, 255))  # Bright red for collision
@@ -76,38 +159,19 @@ class SimpleCADTray:
     
     def get_my_lock_count(self):
         """Count my locks"""
-        count = 0
         try:
-            if os.path.exists(self.lock_dir):
-                for lock_file in os.listdir(self.lock_dir):
-                    if lock_file.endswith('.lock'):
-                        lock_path = os.path.join(self.lock_dir, lock_file)
-                        try:
-                            with open(lock_path, 'r') as f:
-                                lock_data = json.load(f)
-                            if lock_data.get('user') == self.user:
-                                count += 1
-                        except:
-                            continue
-        except:
-            pass
-        return count
+            return len(self.manifest)
+        except Exception:
+            return 0
+    
+    def get_lock_path(self, file_path):
+        """Generate lock file path like main.py does"""
+        return self.lock_paths.lock_path(file_path)
     
     def get_lock_info(self, file_path):
         """Get lock information for a specific file"""
         try:
-            # Generate lock path like main.py does
-            rel_path = os.path.relpath(file_path, self.cad_root)
-            safe_path = rel_path.replace('\\', '_').replace('/', '_').replace(':', '_')
-            safe_path = safe_path.replace('*', '_').replace('?', '_').replace('"', '_')
-            safe_path = safe_path.replace('<', '_').replace('>', '_').replace('|', '_')
-            
-            lock_filename = f"{safe_path}.lock"
-            lock_path = os.path.join(self.lock_dir, lock_filename)
-            
-            if os.path.exists(lock_path):
-                with open(lock_path, 'r') as f:
-                    return json.load(f)
+            return self.lock_store.get(self.get_lock_path(file_path))
         except Exception as e:
             self.log_message(f"Error checking lock for {file_path}: {e}")
         return None
@@ -122,6 +186,8 @@ class SimpleCADTray:
             # Start collision animation
             self.start_collision_animation()
             
+            import tkinter as tk
+            
             # Force the popup to appear on top
             root = tk.Tk()
             root.withdraw()
@@ -172,6 +238,8 @@ class SimpleCADTray:
     
     def animate_collision_icon(self):
         """Animate the tray icon during collision"""
+        from PIL import Image, ImageDraw
+        
         flash_count = 0
         while self.collision_active and flash_count < 6:  # Flash 3 times (6 state changes)
             try:
@@ -226,18 +294,18 @@ class SimpleCADTray:
                 if locked_by and locked_by != self.user:
                     filename = os.path.basename(file_path)
                     
-                    # Only warn once per file per session
+                    # Only warn once per file per session; the popup waits
+                    # for the user, so it is shown from the worker thread
                     if file_path not in self.warned_files:
-                        self.show_collision_warning(file_path, lock_info)
+                        self.tasks.defer(self.show_collision_warning, file_path, lock_info)
                         self.warned_files.add(file_path)
                         collisions_found = True
                     
                     self.log_message(f"COLLISION TYPE 1: {filename} locked by {locked_by}")
         
-        # Scenario 2: Check if multiple people have locks on the same file
-        # This is the crucial line that checks for multiple locks!
-        multiple_locks_found = self.check_for_multiple_locks()
-        collisions_found = collisions_found or multiple_locks_found
+        # Scenario 2: multiple people have locks on the same file, found by
+        # the background conflict scan
+        collisions_found = collisions_found or self.conflicts_found
         
         # Stop animation if no more collisions
         if not collisions_found and self.collision_active:
@@ -245,50 +313,49 @@ class SimpleCADTray:
         
         return collisions_found
         
+    def lock_dir_changed(self):
+        """Check if the lock folder changed since the last check (one stat)"""
+        try:
+            mtime = os.stat(self.lock_dir).st_mtime_ns
+        except OSError:
+            return False
+        changed = mtime != self.lock_dir_mtime
+        self.lock_dir_mtime = mtime
+        return changed
+    
     def check_for_multiple_locks(self):
-        """Check if multiple users have locks on the same file"""
+        """Check if multiple users have locks on the same file (background task)"""
         conflicts_found = False
+        live_lock_folders = set()
         
         try:
-            if not os.path.exists(self.lock_dir):
-                self.log_message("Lock directory doesn't exist - no conflicts possible")
-                return False
-            
-            # Group locks by file path AND by normalized file path
             file_locks = {}
             
-            lock_files = [f for f in os.listdir(self.lock_dir) if f.endswith('.lock')]
-            self.log_message(f"Checking {len(lock_files)} lock files for conflicts")
+            all_locks = self.lock_store.all()
+            self.log_message(f"Checking {len(all_locks)} lock files for conflicts")
             
-            for lock_file in lock_files:
-                lock_path = os.path.join(self.lock_dir, lock_file)
-                try:
-                    with open(lock_path, 'r') as f:
-                        lock_data = json.load(f)
-                    
-                    original_path = lock_data.get('original_path', '')
-                    user = lock_data.get('user', '')
-                    
-                    if original_path and user:
-                        # Normalize the path to catch different representations of same file
-                        normalized_path = os.path.normpath(original_path.lower())
-                        
-                        # Use both original and normalized paths as keys
-                        for key in [original_path, normalized_path]:
-                            if key not in file_locks:
-                                file_locks[key] = []
-                            file_locks[key].append({
-                                'user': user,
-                                'lock_file': lock_file,
-                                'original_path': original_path,
-                                'data': lock_data
-                            })
-                        
-                        self.log_message(f"Found lock: {os.path.basename(original_path)} by {user}")
-                            
-                except Exception as e:
-                    self.log_message(f"Error reading lock file {lock_file}: {e}")
+            for lock_file, lock_data in all_locks:
+                if lock_data is None:
+                    self.log_message(f"Error reading lock file {lock_file}: unreadable lock data")
                     continue
+                
+                original_path = lock_data.get('original_path', '')
+                user = lock_data.get('user', '')
+                
+                if original_path and user:
+                    # Folders with live locks are likely to see temp files soon
+                    live_lock_folders.add(os.path.dirname(original_path))
+                    self.log_message(f"Found lock: {os.path.basename(original_path)} by {user}")
+            
+            # Locks grouped by normalized file path, which also catches
+            # different representations of the same file
+            for normalized_path, locks in self.lock_store.conflicts().items():
+                file_locks[normalized_path] = [{
+                    'user': lock_data.get('user', ''),
+                    'lock_file': lock_file,
+                    'original_path': lock_data.get('original_path', ''),
+                    'data': lock_data
+                } for lock_file, lock_data in locks]
             
             # Check for files with multiple locks
             checked_files = set()
@@ -337,7 +404,9 @@ class SimpleCADTray:
             
         if not conflicts_found:
             self.log_message("No multiple lock conflicts found")
-            
+        
+        self.live_lock_folders = live_lock_folders
+        self.conflicts_found = conflicts_found
         return conflicts_found
     
     def show_multiple_lock_warning(self, file_path, other_users):
@@ -348,6 +417,8 @@ class SimpleCADTray:
             # Start collision animation
             self.start_collision_animation()
             
+            import tkinter as tk
+            
             # Force the popup to appear on top
             root = tk.Tk()
             root.withdraw()
@@ -451,80 +522,101 @@ class SimpleCADTray:
     
     def is_solidworks_running(self):
         """Check if SolidWorks is running"""
-        for proc in psutil.process_iter(['name']):
-            try:
-                if 'sldworks' in proc.info['name'].lower():
-                    return True
-            except:
-                continue
-        return False
+        return self.solidworks.running()
     
     def find_open_files(self):
         """Find open SolidWorks files by detecting temp files"""
         open_files = set()
-        temp_files_found = []
         
         try:
-            # Walk through the CAD directory looking for SolidWorks temp files
-            for root, dirs, files in os.walk(self.cad_root):
-                for file in files:
-                    # SolidWorks creates temp files with ~$ prefix when files are open
-                    if file.startswith('~$'):
-                        temp_files_found.append(os.path.join(root, file))
-                        
-                        if file.lower().endswith(('.sldprt', '.sldasm', '.slddrw')):
-                            # Remove the ~$ prefix to get the original filename
-                            original_file = file[2:]
-                            original_path = os.path.join(root, original_file)
-                            
-                            # Only include if the original file actually exists
-                            if os.path.exists(original_path):
-                                open_files.add(original_path)
+            # Folders of files recently opened via 'main.py open' are hot
+            for recent_path, opened_at in load_recent_opens().items():
+                self.scanner.mark_hot(os.path.dirname(recent_path), opened_at)
+            
+            # So are folders with live locks, as of the last conflict scan
+            for folder in self.live_lock_folders:
+                self.scanner.mark_hot(folder)
+            
+            # SolidWorks creates temp files with ~$ prefix when files are open.
+            # The scanner only re-lists directories that changed since last cycle
+            # and yields matches as soon as their directory has been listed.
+            for original_path in self.scanner.iter_open_files(budget=self.scan_budget):
+                open_files.add(original_path)
             
             # Debug logging
-            if temp_files_found:
-                self.log_message(f"Found {len(temp_files_found)} temp files")
+            if self.scanner.last_temp_count:
+                self.log_message(f"Found {self.scanner.last_temp_count} temp files")
             else:
                 self.log_message("No temp files found in CAD directory")
+            
+            scan_type = "full" if self.scanner.last_scan_was_full else "incremental"
+            self.log_message(f"Scan ({scan_type}): listed {self.scanner.dirs_listed} dirs, reused {self.scanner.dirs_reused} cached, "
+                             f"pruned {self.scanner.dirs_pruned} excluded")
+            if self.scanner.scan_in_progress():
+                self.log_message(f"Scan budget of {self.scan_budget}s used up - resuming next cycle")
+            
+            staleness = self.scanner.staleness()
+            self.log_message(f"Scan tiers: {staleness['hot_dirs']} hot folders (stalest {staleness['hot']:.0f}s), "
+                             f"{staleness['cold_subtrees']} cold subtrees (stalest {staleness['cold']:.0f}s)")
                             
         except Exception as e:
             self.log_message(f"Error scanning for open files: {e}")
             
         return open_files
     
-    def create_lock(self, file_path):
+    def find_open_files_from_process(self):
+        """Find open SolidWorks files from the file handles held by SLDWORKS"""
+        open_files = set()
+        
+        try:
+            open_files = find_open_documents(self.solidworks.processes(), self.cad_root)
+            self.log_message(f"SolidWorks holds {len(open_files)} CAD files open")
+        except Exception as e:
+            self.log_message(f"Error reading SolidWorks file handles: {e}")
+        
+        return open_files
+    
+    def detect_open_files(self, cross_check=False):
+        """Return {file_path: detection_method} for currently open files"""
+        if self.detection_method != 'process_handles':
+            return {path: 'temp_file_scan' for path in self.find_open_files()}
+        
+        detected = {path: 'process_handles' for path in self.find_open_files_from_process()}
+        
+        if cross_check:
+            # Temp files catch documents whose handles we can't see
+            self.temp_only_files = self.find_open_files() - detected.keys()
+            if self.temp_only_files:
+                self.log_message(f"Cross-check found {len(self.temp_only_files)} open files without a SolidWorks handle")
+        
+        # Keep files found only by the cross-check while their temp file exists
+        for path in list(self.temp_only_files):
+            temp_path = os.path.join(os.path.dirname(path), '~$' + os.path.basename(path))
+            if path in detected or not os.path.exists(temp_path):
+                self.temp_only_files.discard(path)
+            else:
+                detected[path] = 'temp_file_scan'
+        
+        return detected
+    
+    def create_lock(self, file_path, detection_method='temp_file_scan', auto_created=True):
         """Create lock file"""
         try:
-            # Simple lock path generation
-            rel_path = os.path.relpath(file_path, self.cad_root)
-            safe_path = rel_path.replace('\\', '_').replace('/', '_').replace(':', '_')
-            safe_path = safe_path.replace('*', '_').replace('?', '_').replace('"', '_')
-            safe_path = safe_path.replace('<', '_').replace('>', '_').replace('|', '_')
-            lock_filename = f"{safe_path}.lock"
-            lock_path = os.path.join(self.lock_dir, lock_filename)
-            
-            # Check if already exists and is ours
-            if os.path.exists(lock_path):
-                with open(lock_path, 'r') as f:
-                    lock_data = json.load(f)
-                if lock_data.get('user') == self.user:
+            lock_path = self.get_lock_path(file_path)
+            
+            lock_data = make_lock_record(self.user, self.computer, file_path, auto_created, detection_method)
+            
+            # Create the lock only if nobody holds it
+            acquired, existing_lock = self.lock_store.acquire(lock_path, lock_data)
+            if not acquired:
+                if existing_lock.get('user') == self.user:
+                    if existing_lock.get('computer') == self.computer:
+                        self.manifest.add(lock_path, file_path)
                     return True  # Already our lock
                 else:
                     return False  # Someone else's lock
             
-            # Create new lock
-            lock_data = {
-                'user': self.user,
-                'computer': self.computer,
-                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'file': os.path.basename(file_path),
-                'original_path': file_path,
-                'auto_created': True
-            }
-            
-            with open(lock_path, 'w') as f:
-                json.dump(lock_data, f, indent=2)
-            
+            self.manifest.add(lock_path, file_path)
             self.log_message(f"LOCKED: {os.path.basename(file_path)}")
             return True
             
@@ -535,19 +627,13 @@ class SimpleCADTray:
     def remove_lock(self, file_path):
         """Remove lock file"""
         try:
-            rel_path = os.path.relpath(file_path, self.cad_root)
-            safe_path = rel_path.replace('\\', '_').replace('/', '_').replace(':', '_')
-            safe_path = safe_path.replace('*', '_').replace('?', '_').replace('"', '_')
-            safe_path = safe_path.replace('<', '_').replace('>', '_').replace('|', '_')
-            lock_filename = f"{safe_path}.lock"
-            lock_path = os.path.join(self.lock_dir, lock_filename)
-            
-            if os.path.exists(lock_path):
-                with open(lock_path, 'r') as f:
-                    lock_data = json.load(f)
-                
+            lock_path = self.get_lock_path(file_path)
+            lock_data = self.lock_store.get(lock_path)
+            
+            if lock_data:
                 if lock_data.get('user') == self.user and lock_data.get('auto_created'):
-                    os.remove(lock_path)
+                    self.lock_store.remove(lock_path)
+                    self.manifest.discard(lock_path)
                     self.log_message(f"UNLOCKED: {os.path.basename(file_path)}")
                     return True
             return False
@@ -560,20 +646,15 @@ class SimpleCADTray:
         """Remove all auto-created locks by current user"""
         removed = 0
         try:
-            if os.path.exists(self.lock_dir):
-                for lock_file in os.listdir(self.lock_dir):
-                    if lock_file.endswith('.lock'):
-                        lock_path = os.path.join(self.lock_dir, lock_file)
-                        try:
-                            with open(lock_path, 'r') as f:
-                                lock_data = json.load(f)
-                            
-                            if (lock_data.get('user') == self.user and 
-                                lock_data.get('auto_created')):
-                                os.remove(lock_path)
-                                removed += 1
-                        except:
-                            continue
+            for lock_file, lock_data in self.manifest.held():
+                if lock_data.get('auto_created'):
+                    lock_path = self.lock_store.lock_path(lock_file)
+                    try:
+                        self.lock_store.remove(lock_path)
+                        self.manifest.discard(lock_path)
+                        removed += 1
+                    except:
+                        continue
         except:
             pass
         
@@ -581,161 +662,220 @@ class SimpleCADTray:
             self.log_message(f"CLEANUP: Removed {removed} locks")
         return removed
     
+    def sync_open_files(self, cross_check=False):
+        """Detect open files, check collisions and reconcile my auto-locks"""
+        collision_detected = False
+        
+        # Get currently open files
+        open_files = self.detect_open_files(cross_check)
+        self.log_message(f"Found {len(open_files)} open files")
+        self.open_files_changed = set(open_files) != self.last_open_files
+        self.last_open_files = set(open_files)
+        
+        if cross_check:
+            # Drop manifest entries for locks that are gone, re-add missed ones
+            self.manifest.reseed()
+        
+        # Create locks for ALL open files - ensure every open file has a lock from me
+        for file_path in open_files:
+            lock_path = self.get_lock_path(file_path)
+            
+            lock_data = make_lock_record(self.user, self.computer, file_path, True, open_files[file_path])
+            
+            try:
+                # One exclusive create: either the lock is mine now, or we
+                # get back whoever already holds it
+                acquired, existing_lock = self.lock_store.acquire(lock_path, lock_data)
+            except Exception as e:
+                self.log_message(f"Error creating auto-lock for {file_path}: {e}")
+                continue
+            
+            if acquired:
+                self.manifest.add(lock_path, file_path)
+                self.log_message(f"AUTO-CREATED LOCK: {os.path.basename(file_path)} (opened via SolidWorks)")
+            elif existing_lock.get('user') == self.user:
+                if existing_lock.get('computer') == self.computer:
+                    self.manifest.add(lock_path, file_path)
+                # I already have a lock - the heartbeat keeps it alive, only
+                # rewrite it if it has to become auto-managed
+                if not existing_lock.get('auto_created'):
+                    try:
+                        self.lock_store.write(lock_path, dict(existing_lock, auto_created=True))
+                    except Exception as e:
+                        self.log_message(f"Error updating lock: {e}")
+            else:
+                self.log_message(f"LOCK HELD BY {existing_lock.get('user')}: {os.path.basename(file_path)}")
+        
+        # Check for collisions once our locks are taken (popups are deferred)
+        collision_detected = self.check_for_collisions(open_files)
+        
+        # Remove locks for files that are no longer open
+        try:
+            removed_any = False
+            my_locks = self.manifest.held()
+            for lock_file, lock_data in my_locks:
+                # Only process our auto-created locks
+                if not lock_data.get('auto_created'):
+                    continue
+                original_path = lock_data.get('original_path') or self.lock_paths.original_path(lock_file)
+                
+                if original_path:
+                    # Check if this file is still open. Until the first
+                    # budgeted walk completes, not every folder has been seen.
+                    temp_path = os.path.join(os.path.dirname(original_path), '~$' + os.path.basename(original_path))
+                    if (original_path not in open_files and
+                        (self.scanner.complete or not os.path.exists(temp_path))):
+                        # File is no longer open, remove the lock
+                        lock_path = self.lock_store.lock_path(lock_file)
+                        try:
+                            self.lock_store.remove(lock_path)
+                            self.manifest.discard(lock_path)
+                            self.log_message(f"UNLOCKED: {os.path.basename(original_path)}")
+                            removed_any = True
+                        except Exception as e:
+                            self.log_message(f"Error removing lock file {lock_file}: {e}")
+                            continue
+                            
+            if not removed_any and len(open_files) == 0:
+                # No open files but we might have locks - remove them all
+                if my_locks:
+                    self.log_message(f"No open files detected but {len(my_locks)} locks remain - removing all auto-locks...")
+                    # Remove all our auto-created locks since no files are open
+                    for lock_file, lock_data in my_locks:
+                        lock_path = self.lock_store.lock_path(lock_file)
+                        self.log_message(f"Lock data - File: {lock_file}, Auto: {lock_data.get('auto_created')}")
+                        
+                        if lock_data.get('auto_created'):
+                            try:
+                                self.log_message(f"Attempting to remove: {lock_path}")
+                                self.lock_store.remove(lock_path)
+                                self.manifest.discard(lock_path)
+                                self.log_message(f"UNLOCKED: {lock_data.get('file', 'unknown')} (no temp file)")
+                                removed_any = True
+                            except Exception as e:
+                                self.log_message(f"Error processing lock {lock_file}: {e}")
+                                continue
+                        else:
+                            self.log_message(f"Skipping manual lock: {lock_file}")
+                                    
+        except Exception as e:
+            self.log_message(f"Error during cleanup: {e}")
+        
+        return collision_detected
+    
+    def handle_watch_events(self, events):
+        """Lock or unlock files as soon as the watcher reports temp file events"""
+        collision_detected = False
+        
+        for kind, file_path in events:
+            if kind == 'open':
+                if not os.path.exists(file_path):
+                    continue
+                self.log_message(f"Temp file created: {os.path.basename(file_path)}")
+                collision_detected = self.check_for_collisions({file_path}) or collision_detected
+                self.create_lock(file_path)
+            else:
+                self.log_message(f"Temp file removed: {os.path.basename(file_path)}")
+                self.remove_lock(file_path)
+        
+        return collision_detected
+    
     def monitor_loop(self):
         """Main monitoring loop with collision detection"""
         self.log_message("Monitor started with collision detection")
         
+        watching = self.monitor_mode == 'watch' and self.watcher.start()
+        if watching:
+            self.log_message(f"Watching for temp file events (full scan every {self.watch_rescan_interval}s)")
+        elif self.monitor_mode == 'watch':
+            self.log_message("File watcher unavailable (pip install watchdog) - polling instead")
+        last_scan = 0
+        wait = self.scheduler.next_wait()
+        
+        # Collision state from the last full scan carries over event-only cycles
+        collision_detected = False
+        
         while self.monitor_running:
             try:
+                # In watch mode, block until an event arrives or the interval passes
+                events = self.watcher.get_events(timeout=wait) if watching else []
+                if not self.monitor_running:
+                    # Woken by stop_monitoring, don't start another cycle
+                    break
+                
+                if watching and not self.watcher.is_healthy():
+                    self.log_message("File watcher lost events - running full scan")
+                    self.watcher.reset()
+                    last_scan = 0
+                
                 sw_running = self.is_solidworks_running()
                 self.log_message(f"SolidWorks running: {sw_running}")
                 
-                collision_detected = False
-                
+                changed = bool(events)
                 if sw_running:
-                    # Get currently open files
-                    open_files = self.find_open_files()
-                    self.log_message(f"Found {len(open_files)} open files")
-                    
-                    # Check for collisions FIRST (this includes multiple lock detection)
-                    collision_detected = self.check_for_collisions(open_files)
-                    
-                    # Even if no collision from open files, check for ANY multiple locks in the system
-                    if not collision_detected:
-                        collision_detected = self.check_for_multiple_locks()
-                    
-                    # Create locks for ALL open files - ensure every open file has a lock from me
-                    for file_path in open_files:
-                        # Check if I already have a lock for this file
-                        existing_lock = self.get_lock_info(file_path)
-                        
-                        if not existing_lock or existing_lock.get('user') != self.user:
-                            # I don't have a lock for this file - create one
-                            lock_data = {
-                                'user': self.user,
-                                'computer': self.computer,
-                                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                'file': os.path.basename(file_path),
-                                'original_path': file_path,
-                                'auto_created': True,
-                                'detection_method': 'temp_file_scan'
-                            }
-                            
-                            # Generate lock path
-                            rel_path = os.path.relpath(file_path, self.cad_root)
-                            safe_path = rel_path.replace('\\', '_').replace('/', '_').replace(':', '_')
-                            safe_path = safe_path.replace('*', '_').replace('?', '_').replace('"', '_')
-                            safe_path = safe_path.replace('<', '_').replace('>', '_').replace('|', '_')
-                            lock_filename = f"{safe_path}.lock"
-                            lock_path = os.path.join(self.lock_dir, lock_filename)
-                            
-                            try:
-                                with open(lock_path, 'w') as f:
-                                    json.dump(lock_data, f, indent=2)
-                                
-                                self.log_message(f"AUTO-CREATED LOCK: {os.path.basename(file_path)} (opened via SolidWorks)")
-                                
-                            except Exception as e:
-                                self.log_message(f"Error creating auto-lock for {file_path}: {e}")
-                        else:
-                            # I already have a lock - just update timestamp
-                            try:
-                                rel_path = os.path.relpath(file_path, self.cad_root)
-                                safe_path = rel_path.replace('\\', '_').replace('/', '_').replace(':', '_')
-                                safe_path = safe_path.replace('*', '_').replace('?', '_').replace('"', '_')
-                                safe_path = safe_path.replace('<', '_').replace('>', '_').replace('|', '_')
-                                lock_filename = f"{safe_path}.lock"
-                                lock_path = os.path.join(self.lock_dir, lock_filename)
-                                
-                                if os.path.exists(lock_path):
-                                    with open(lock_path, 'r') as f:
-                                        lock_data = json.load(f)
-                                    
-                                    lock_data['last_seen'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                                    lock_data['auto_created'] = True
-                                    
-                                    with open(lock_path, 'w') as f:
-                                        json.dump(lock_data, f, indent=2)
-                                        
-                            except Exception as e:
-                                self.log_message(f"Error updating lock timestamp: {e}")
+                    if events:
+                        collision_detected = self.handle_watch_events(events) or collision_detected
                     
-                    # Remove locks for files that are no longer open
-                    try:
-                        removed_any = False
-                        if os.path.exists(self.lock_dir):
-                            for lock_file in os.listdir(self.lock_dir):
-                                if lock_file.endswith('.lock'):
-                                    lock_path = os.path.join(self.lock_dir, lock_file)
-                                    try:
-                                        with open(lock_path, 'r') as f:
-                                            lock_data = json.load(f)
-                                        
-                                        # Only process our auto-created locks
-                                        if (lock_data.get('user') == self.user and 
-                                            lock_data.get('auto_created')):
-                                            original_path = lock_data.get('original_path')
-                                            
-                                            if original_path:
-                                                # Check if this file is still open
-                                                if original_path not in open_files:
-                                                    # File is no longer open, remove the lock
-                                                    os.remove(lock_path)
-                                                    self.log_message(f"UNLOCKED: {os.path.basename(original_path)}")
-                                                    removed_any = True
-                                    except Exception as e:
-                                        # If we can't read the lock file, skip it
-                                        self.log_message(f"Error reading lock file {lock_file}: {e}")
-                                        continue
-                                        
-                        if not removed_any and len(open_files) == 0:
-                            # No open files but we might have locks - remove them all
-                            my_locks = self.get_my_lock_count()
-                            if my_locks > 0:
-                                self.log_message(f"No open files detected but {my_locks} locks remain - removing all auto-locks...")
-                                # Remove all our auto-created locks since no files are open
-                                if os.path.exists(self.lock_dir):
-                                    for lock_file in os.listdir(self.lock_dir):
-                                        if lock_file.endswith('.lock'):
-                                            lock_path = os.path.join(self.lock_dir, lock_file)
-                                            self.log_message(f"Checking lock file: {lock_file}")
-                                            try:
-                                                with open(lock_path, 'r') as f:
-                                                    lock_data = json.load(f)
-                                                
-                                                self.log_message(f"Lock data - User: {lock_data.get('user')}, Auto: {lock_data.get('auto_created')}")
-                                                
-                                                if (lock_data.get('user') == self.user and 
-                                                    lock_data.get('auto_created')):
-                                                    self.log_message(f"Attempting to remove: {lock_path}")
-                                                    os.remove(lock_path)
-                                                    self.log_message(f"UNLOCKED: {lock_data.get('file', 'unknown')} (no temp file)")
-                                                    removed_any = True
-                                                else:
-                                                    self.log_message(f"Skipping lock - User: {lock_data.get('user')} (me: {self.user}), Auto: {lock_data.get('auto_created')}")
-                                                    
-                                            except Exception as e:
-                                                self.log_message(f"Error processing lock {lock_file}: {e}")
-                                                continue
-                                                
-                    except Exception as e:
-                        self.log_message(f"Error during cleanup: {e}")
-                        
+                    # Polling scan every cycle, or as a safety net in watch mode.
+                    # Handle detection is cheap, so it runs every cycle and the
+                    # tree walk only runs as a periodic cross-check.
+                    scan_due = time.time() - last_scan >= self.watch_rescan_interval
+                    if not watching or scan_due or self.detection_method == 'process_handles':
+                        collision_detected = self.sync_open_files(cross_check=scan_due)
+                        changed = self.open_files_changed or changed
+                        if scan_due:
+                            last_scan = time.time()
                 else:
                     # SolidWorks not running - cleanup all our auto-locks
                     removed = self.cleanup_my_locks()
                     if removed > 0:
                         self.log_message(f"CLEANUP: SolidWorks closed - removed {removed} locks")
+                    collision_detected = False
+                    self.last_open_files = set()
+                
+                # One heartbeat per cycle keeps all of my locks alive
+                self.lock_store.beat(self.user, self.computer)
+                
+                # Hand a due conflict scan to the worker thread
+                if sw_running:
+                    self.tasks.run_due()
                 
                 # Update icon with current counts (show warning if collision detected)
-                self.update_icon(warning=collision_detected)
+                self.update_icon(warning=collision_detected or (sw_running and self.conflicts_found))
+                
+                # Sooner after activity, later while quiet
+                self.scheduler.update(sw_running, changed)
+                wait = self.scheduler.next_wait()
+                self.log_message(f"Check interval: {self.scheduler.interval:g}s, next check in {wait:.1f}s")
                 
-                time.sleep(10)  # Check every 10 seconds
+                # Wait before next check, or until SolidWorks exits
+                if not watching:
+                    self.watcher.get_events(timeout=wait)
                 
             except Exception as e:
                 self.log_message(f"Monitor error: {e}")
                 time.sleep(5)
         
+        self.watcher.stop()
+        
+    def handle_agent_request(self, request):
+        """Lock a file for 'agent.py open' (runs on the agent's thread)"""
+        if request.get('action') != 'open':
+            return {'ok': False, 'error': f"Unknown action: {request.get('action')}"}
+        
+        file_path = request.get('path') or ''
+        if not os.path.exists(file_path):
+            return {'ok': False, 'error': f"File not found: {file_path}"}
+        
+        # A manual lock, like 'main.py open'; someone else's lock (or an
+        # error) sends the client to main.py for the read-only copy
+        if not self.create_lock(file_path, detection_method='manual', auto_created=False):
+            return {'ok': False}
+        
+        record_recent_open(file_path)
+        self.log_message(f"OPEN: {os.path.basename(file_path)}")
+        return {'ok': True}
+    
     def update_icon(self, warning=False):
         """Update tray icon"""
         try:
@@ -765,24 +905,32 @@ class SimpleCADTray:
         """Stop monitoring"""
         if self.monitor_running:
             self.monitor_running = False
+            # Wake the loop if it is waiting on the watcher, so it exits
+            # before our locks are cleaned up
+            self.watcher.wake()
+            if self.monitor_thread:
+                self.monitor_thread.join(timeout=5)
             self.cleanup_my_locks()
             self.log_message("Monitoring stopped")
             self.update_icon()
     
     def unlock_all(self, icon=None, item=None):
-        """Unlock all my files"""
+        """Unlock all my files held from this computer"""
         removed = self.cleanup_my_locks()
         self.update_icon()
     
     def quit_app(self, icon=None, item=None):
         """Quit application"""
         self.log_message("Shutting down...")
+        self.agent.stop()
         self.stop_monitoring()
         if hasattr(self, 'tray_icon'):
             self.tray_icon.stop()
     
     def run(self):
         """Run the tray application"""
+        import pystray
+        
         print("Creating system tray icon...")
         
         # Create menu
@@ -806,6 +954,8 @@ class SimpleCADTray:
         
         # Auto-start monitoring
         self.start_monitoring()
+        if self.agent_enabled:
+            self.agent.start()
         
         print("Starting tray icon...")
         try:
@@ -17,9 +17,9 @@ cd /d "%INSTALL_DIR%"
 
 REM Install required packages
 echo Checking/installing required packages...
-python -c "import pystray, PIL, psutil" 2>nul || (
+python -c "import pystray, PIL, psutil, watchdog" 2>nul || (
     echo Installing required packages...
-    pip install pystray pillow psutil
+    pip install pystray pillow psutil watchdog
     echo.
 )
 
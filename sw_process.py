@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+import psutil
+
+from scanner import CAD_EXTENSIONS
+
+
+def find_solidworks_processes():
+    """Return the running SLDWORKS processes"""
+    processes = []
+    for proc in psutil.process_iter(['name']):
+        try:
+            if proc.info['name'] and 'sldworks' in proc.info['name'].lower():
+                processes.append(proc)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return processes
+
+
+def _is_running(proc):
+    try:
+        return proc.is_running()
+    except psutil.Error:
+        return False
+
+
+class SolidWorksTracker:
+    """Track the running SLDWORKS processes without listing every process
+
+    Processes once found are confirmed alive with a per-PID check, which also
+    notices a reused PID. All processes are only enumerated while none is
+    known, or every rescan_interval seconds to pick up another instance.
+    While SolidWorks runs, a waiter thread blocks on its processes and calls
+    on_exit as soon as the last one exits.
+    """
+
+    def __init__(self, rescan_interval=60, on_exit=None):
+        self.rescan_interval = rescan_interval
+        self.on_exit = on_exit
+        self.lock = threading.Lock()
+        self.known = []
+        self.last_scan = 0
+        self.waiter = None
+
+    def processes(self):
+        """Return the running SLDWORKS processes"""
+        with self.lock:
+            self.known = [proc for proc in self.known if _is_running(proc)]
+            if not self.known or time.time() - self.last_scan >= self.rescan_interval:
+                self.known = find_solidworks_processes()
+                self.last_scan = time.time()
+
+            if self.known and self.on_exit and self.waiter is None:
+                self.waiter = threading.Thread(target=self._wait_for_exit, daemon=True)
+                self.waiter.start()
+            return list(self.known)
+
+    def running(self):
+        """Check if SolidWorks is running"""
+        return bool(self.processes())
+
+    def _wait_for_exit(self):
+        while True:
+            with self.lock:
+                known = list(self.known)
+            try:
+                psutil.wait_procs(known, timeout=self.rescan_interval)
+            except psutil.Error:
+                time.sleep(1)
+
+            with self.lock:
+                # Another instance may have been found while we waited
+                self.known = [proc for proc in self.known if _is_running(proc)]
+                if not self.known:
+                    self.waiter = None
+                    break
+        self.on_exit()
+
+
+def find_open_documents(processes, cad_root):
+    """Return CAD documents under cad_root that the given processes hold open
+
+    SolidWorks keeps a handle on every loaded document, so reading the
+    process's open files gives the set of open documents without walking
+    the CAD tree.
+    """
+    root = os.path.normcase(os.path.join(os.path.abspath(cad_root), ''))
+    open_files = set()
+
+    for proc in processes:
+        try:
+            handles = proc.open_files()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+
+        for handle in handles:
+            name = os.path.basename(handle.path)
+            if name.startswith('~$') or not name.lower().endswith(CAD_EXTENSIONS):
+                continue
+            if os.path.normcase(handle.path).startswith(root):
+                open_files.add(handle.path)
+
+    return open_files
@@ -0,0 +1,129 @@
+import os
+import queue
+
+# watchdog is optional - without it the monitors fall back to polling scans.
+# It uses inotify on Linux and ReadDirectoryChangesW on Windows.
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+    WATCHDOG_AVAILABLE = False
+
+from scanner import is_cad_temp_file
+
+
+class _TempFileEventHandler(FileSystemEventHandler):
+    """Forward temp file create/delete events to the watcher queue"""
+
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.push_event('open', event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.watcher.push_event('close', event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.push_event('close', event.src_path)
+            self.watcher.push_event('open', event.dest_path)
+
+
+class TempFileWatcher:
+    """Watch the CAD tree for SolidWorks ~$ temp files being created or deleted
+
+    Events are queued as ('open' | 'close', original_path) tuples and consumed
+    by the monitor loop, so all lock I/O stays on the monitor thread. If the
+    queue overflows or the observer thread dies, is_healthy() turns False and
+    the caller should run a full polling scan before trusting events again.
+    """
+
+    def __init__(self, root, max_events=10000, rules=None):
+        self.root = root
+        self.rules = rules
+        self.events = queue.Queue(maxsize=max_events)
+        self.observer = None
+        self.overflowed = False
+
+    def start(self):
+        """Start watching, returns False if no watcher backend is available"""
+        if not WATCHDOG_AVAILABLE:
+            return False
+        if self.observer is not None:
+            return True
+
+        try:
+            self.observer = Observer()
+            self.observer.schedule(_TempFileEventHandler(self), self.root, recursive=True)
+            self.observer.daemon = True
+            self.observer.start()
+            return True
+        except Exception as e:
+            print(f"Could not start file watcher: {e}")
+            self.observer = None
+            return False
+
+    def stop(self):
+        """Stop watching"""
+        if self.observer is not None:
+            try:
+                self.observer.stop()
+                self.observer.join(timeout=5)
+            except Exception:
+                pass
+            self.observer = None
+
+    def is_healthy(self):
+        """Check that no events were lost since the last reset"""
+        return (self.observer is not None and self.observer.is_alive()
+                and not self.overflowed)
+
+    def reset(self):
+        """Drop queued events and clear the overflow flag (after a full scan)"""
+        self.get_events(timeout=0)
+        self.overflowed = False
+        if self.observer is not None and not self.observer.is_alive():
+            self.observer = None
+            self.start()
+
+    def push_event(self, kind, temp_path):
+        """Queue an event for a temp file path, ignoring non-CAD files"""
+        name = os.path.basename(temp_path)
+        if not is_cad_temp_file(name):
+            return
+
+        folder = os.path.dirname(temp_path)
+        if self.rules and self.rules.excludes_tree(folder):
+            return
+
+        original_path = os.path.join(folder, name[2:])
+        try:
+            self.events.put_nowait((kind, original_path))
+        except queue.Full:
+            self.overflowed = True
+
+    def wake(self):
+        """Make a waiting get_events return now, e.g. when SolidWorks exits"""
+        try:
+            self.events.put_nowait(('wake', None))
+        except queue.Full:
+            pass
+
+    def get_events(self, timeout=None):
+        """Wait up to timeout seconds for an event, then return all queued events"""
+        events = []
+        try:
+            if timeout:
+                events.append(self.events.get(timeout=timeout))
+            while True:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return [event for event in events if event[0] != 'wake']